@@ -0,0 +1,186 @@
+import gzip
+import io
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tarfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator, NamedTuple, Optional
+
+from app.storage import COPY_CHUNK_SIZE, archive_suffix
+
+logger = logging.getLogger(__name__)
+
+class ArchiveMember(NamedTuple):
+    name: str # Name inside the archive
+    # Only valid until the iterator advances, which lets sequential formats be read without random access
+    stream: BinaryIO
+    size: Optional[int] = None # Uncompressed size from the member header, when the format records it
+
+TAR_SUFFIXES = {".tar": None, ".tar.gz": "gz", ".tgz": "gz", ".tar.zst": "zst", ".tzst": "zst"}
+SUPPORTED_ARCHIVE_SUFFIXES = (".zip",) + tuple(TAR_SUFFIXES)
+
+# Decoded chunks buffered ahead of the consumer by PrefetchReader
+PREFETCH_DEPTH = int(os.environ.get("INGEST_PREFETCH_DEPTH", "8"))
+
+
+class UnsupportedArchiveError(ValueError):
+    pass
+
+
+class PrefetchReader(io.RawIOBase):
+    """
+    Calls `read_chunk` on a background thread and keeps up to `depth` decoded chunks
+    ready. zlib and zstd release the GIL while decoding, so decompression overlaps
+    with hashing and writing files on the consuming thread.
+    """
+
+    def __init__(self, read_chunk: Callable[[], bytes], depth: int = PREFETCH_DEPTH):
+        super().__init__()
+        self._read_chunk = read_chunk
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        self._pending = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, name="archive-prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self):
+        try:
+            while True:
+                chunk = self._read_chunk()
+                if not self._put(chunk) or not chunk:
+                    return
+        except BaseException as e: # Re-raised on the consumer thread
+            self._put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._pending = memoryview(item)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+@contextmanager
+def subprocess_stream(command) -> Iterator[BinaryIO]:
+    """Yields the stdout of a decompressor process, failing if it exits non-zero."""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=COPY_CHUNK_SIZE)
+    try:
+        yield process.stdout
+        process.stdout.read() # Drain trailing padding so the exit status reflects the whole stream
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise OSError(f"{command[0]} exited with status {returncode}: {stderr.decode(errors='replace').strip()}")
+
+
+@contextmanager
+def prefetched(source: BinaryIO, decode: Callable[[], bytes]) -> Iterator[BinaryIO]:
+    reader = PrefetchReader(decode)
+    try:
+        yield io.BufferedReader(reader, buffer_size=COPY_CHUNK_SIZE)
+    finally:
+        reader.close()
+        source.close()
+
+
+def open_decompressed(archive_path: str, codec):
+    """
+    Opens `archive_path` as a sequential stream of decompressed tar bytes.
+
+    gzip prefers `pigz`, which inflates in a separate process with its own read, write
+    and checksum threads; zstd decodes through the `zstandard` module. Both fall back to
+    an in-process decoder on a prefetch thread.
+    """
+    if codec is None:
+        return open(archive_path, "rb", buffering=COPY_CHUNK_SIZE)
+
+    if codec == "gz":
+        pigz = shutil.which("pigz")
+        if pigz:
+            return subprocess_stream([pigz, "-dc", archive_path])
+        source = gzip.open(archive_path, "rb")
+        return prefetched(source, lambda: source.read(COPY_CHUNK_SIZE))
+
+    if codec == "zst":
+        try:
+            import zstandard
+        except ImportError:
+            zstd = shutil.which("zstd")
+            if zstd:
+                return subprocess_stream([zstd, "-dc", "--no-progress", archive_path])
+            raise UnsupportedArchiveError("tar.zst archives require the 'zstandard' package or the zstd utility")
+        raw = open(archive_path, "rb")
+        source = zstandard.ZstdDecompressor().stream_reader(raw, read_size=COPY_CHUNK_SIZE, closefd=True)
+        return prefetched(source, lambda: source.read(COPY_CHUNK_SIZE))
+
+    raise UnsupportedArchiveError(f"Unknown compression: {codec}")
+
+
+def iter_zip_members(archive_path: str) -> Iterator[ArchiveMember]:
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            with zip_ref.open(info) as stream:
+                yield ArchiveMember(info.filename, stream, info.file_size)
+
+
+def iter_tar_members(archive_path: str, codec=None) -> Iterator[ArchiveMember]:
+    """Reads a (compressed) tarball strictly front to back; only regular files are yielded."""
+    with open_decompressed(archive_path, codec) as stream:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    if not member.isdir():
+                        logger.info(f"Skipping non-regular tar member: {member.name}")
+                    continue
+                yield ArchiveMember(member.name, tar.extractfile(member), member.size)
+
+
+def iter_archive_members(archive_path: str) -> Iterator[ArchiveMember]:
+    suffix = archive_suffix(archive_path)
+    if suffix == ".zip":
+        return iter_zip_members(archive_path)
+    if suffix in TAR_SUFFIXES:
+        return iter_tar_members(archive_path, TAR_SUFFIXES[suffix])
+    raise UnsupportedArchiveError(f"Unsupported file type: {suffix}")
@@ -0,0 +1,177 @@
+import asyncio
+import base64
+import logging
+import os
+import random
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional
+
+from app.models import PromptStyle
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Remote captioning backend (any OpenAI-compatible chat completions endpoint)
+CAPTION_API_URL = os.environ.get("CAPTION_API_URL", "http://captioner:8080/v1/chat/completions")
+CAPTION_API_KEY = os.environ.get("CAPTION_API_KEY")
+CAPTION_MODEL = os.environ.get("CAPTION_MODEL", "llava")
+CAPTION_CONCURRENCY = int(os.environ.get("CAPTION_CONCURRENCY", "4"))
+CAPTION_MAX_RETRIES = int(os.environ.get("CAPTION_MAX_RETRIES", "3"))
+CAPTION_BACKOFF_BASE = float(os.environ.get("CAPTION_BACKOFF_BASE", "0.5"))
+CAPTION_TIMEOUT = float(os.environ.get("CAPTION_TIMEOUT", "120"))
+
+# Prompts tuned for the caption format each base model was trained on
+PROMPTS = {
+    PromptStyle.SDXL: (
+        "Describe this image as a comma-separated list of short tags, most important first. "
+        "Cover subject, clothing, pose, setting, lighting and style. Output only the tags."
+    ),
+    PromptStyle.FLUX: (
+        "Describe this image in one or two natural-language sentences, covering the subject, "
+        "what they are doing, the setting, lighting and photographic style. Output only the description."
+    ),
+}
+
+# Status codes worth retrying; everything else in the 4xx range is treated as permanent
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class CaptionJob:
+    key: str # Opaque identifier handed back with the outcome (e.g. the image id)
+    path: str
+    mime_type: Optional[str]
+
+
+@dataclass
+class CaptionOutcome:
+    key: str
+    caption: Optional[str] = None
+    error: Optional[str] = None
+
+
+class CaptionClient:
+    """
+    Async client for a remote captioning LLM.
+
+    At most `concurrency` requests are in flight at once; transient failures
+    (connection errors, timeouts, 429/5xx) are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        base_url: str = CAPTION_API_URL,
+        model: str = CAPTION_MODEL,
+        concurrency: int = CAPTION_CONCURRENCY,
+        max_retries: int = CAPTION_MAX_RETRIES,
+        backoff_base: float = CAPTION_BACKOFF_BASE,
+        timeout: float = CAPTION_TIMEOUT,
+        api_key: Optional[str] = CAPTION_API_KEY,
+    ):
+        self.base_url = base_url
+        self.model = model
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self.api_key = api_key
+
+    def _build_payload(self, image_bytes: bytes, mime_type: Optional[str], prompt_style: PromptStyle) -> dict:
+        data_uri = f"data:{mime_type or 'image/jpeg'};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": PROMPTS[prompt_style]},
+                        {"type": "image_url", "image_url": {"url": data_uri}},
+                    ],
+                }
+            ],
+        }
+
+    async def _caption_one(
+        self,
+        client: "httpx.AsyncClient",
+        semaphore: asyncio.Semaphore,
+        job: CaptionJob,
+        prompt_style: PromptStyle,
+    ) -> CaptionOutcome:
+        import httpx
+
+        async with semaphore:
+            try:
+                # Read inside the semaphore so only `concurrency` images are held in memory at once
+                with open(job.path, "rb") as f:
+                    payload = self._build_payload(f.read(), job.mime_type, prompt_style)
+            except OSError as e:
+                return CaptionOutcome(key=job.key, error=f"Could not read {job.path}: {e}")
+
+            last_error = None
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    delay = self.backoff_base * (2 ** (attempt - 1))
+                    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                try:
+                    response = await client.post(self.base_url, json=payload)
+                except httpx.TransportError as e:
+                    last_error = f"{type(e).__name__}: {e}"
+                    logger.warning(f"Caption request for {job.key} failed (attempt {attempt + 1}): {last_error}")
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    last_error = f"HTTP {response.status_code}"
+                    logger.warning(f"Caption request for {job.key} failed (attempt {attempt + 1}): {last_error}")
+                    continue
+                if response.status_code >= 400:
+                    return CaptionOutcome(key=job.key, error=f"HTTP {response.status_code}: {response.text[:200]}")
+
+                try:
+                    caption = response.json()["choices"][0]["message"]["content"].strip()
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    return CaptionOutcome(key=job.key, error=f"Malformed response: {e}")
+                return CaptionOutcome(key=job.key, caption=caption)
+
+            return CaptionOutcome(key=job.key, error=f"Gave up after {self.max_retries + 1} attempts: {last_error}")
+
+    async def caption_many(self, jobs: List[CaptionJob], prompt_style: PromptStyle) -> List[CaptionOutcome]:
+        """Captions all jobs with bounded concurrency; outcomes are returned in input order."""
+        import httpx # Only captioning workers pay for the HTTP stack
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, headers=headers, limits=limits) as client:
+            return await asyncio.gather(
+                *(self._caption_one(client, semaphore, job, prompt_style) for job in jobs)
+            )
+
+    def caption_all(self, jobs: List[CaptionJob], prompt_style: PromptStyle) -> List[CaptionOutcome]:
+        """Synchronous entry point for Celery tasks."""
+        if not jobs:
+            return []
+        return asyncio.run(self.caption_many(jobs, prompt_style))
+
+
+def sidecar_path_for(image_path: str) -> str:
+    return os.path.splitext(image_path)[0] + ".txt"
+
+
+def read_sidecar(image_path: str) -> Optional[str]:
+    """Returns the text of the image's `<stem>.txt` sidecar, or None if it has none."""
+    try:
+        with open(sidecar_path_for(image_path), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_sidecar(image_path: str, caption: str) -> str:
+    """Writes `caption` next to the image as `<stem>.txt` and returns the sidecar path."""
+    sidecar_path = sidecar_path_for(image_path)
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        f.write(caption)
+    return sidecar_path
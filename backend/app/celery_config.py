@@ -0,0 +1,50 @@
+import os
+
+from kombu import Exchange, Queue
+
+# Named queues. Each is consumed by its own worker pool (see docker-compose.yml) so a
+# multi-hour ingest never sits in front of an interactive job.
+INGEST_QUEUE = "ingest" # Archive unpacking, re-ingest, dataset deletion: long and I/O bound
+CPU_BATCH_QUEUE = "cpu-batch" # Captioning and other per-image batch work
+INTERACTIVE_QUEUE = "interactive" # Short jobs a user is waiting on (thumbnails, stats refreshes)
+
+# Redis emulates priorities with one list per step; 0 is consumed first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+TASK_ROUTES = {
+    "worker.app.worker.process_dataset_upload": {"queue": INGEST_QUEUE, "priority": PRIORITY_LOW},
+    # Usually small deltas; let them overtake full uploads waiting in the same queue
+    "worker.app.worker.add_files_to_dataset": {"queue": INGEST_QUEUE, "priority": PRIORITY_NORMAL},
+    "worker.app.worker.delete_dataset": {"queue": INGEST_QUEUE, "priority": PRIORITY_NORMAL},
+    "worker.app.worker.caption_dataset_images": {"queue": CPU_BATCH_QUEUE, "priority": PRIORITY_NORMAL},
+    "worker.app.worker.rebuild_dataset_snapshot": {"queue": CPU_BATCH_QUEUE, "priority": PRIORITY_LOW},
+}
+
+# Tasks that may run longer than this are redelivered by Redis while still running, so it
+# must exceed the longest acks_late task.
+VISIBILITY_TIMEOUT = int(os.environ.get("CELERY_VISIBILITY_TIMEOUT", str(12 * 3600)))
+WORKER_PREFETCH_MULTIPLIER = int(os.environ.get("CELERY_WORKER_PREFETCH_MULTIPLIER", "1"))
+
+
+def configure_celery(app):
+    """Applies queue, routing and priority settings; used by both the API (producer) and the worker."""
+    app.conf.update(
+        task_queues=tuple(
+            Queue(name, Exchange(name, type="direct"), routing_key=name)
+            for name in (INGEST_QUEUE, CPU_BATCH_QUEUE, INTERACTIVE_QUEUE)
+        ),
+        task_default_queue=INTERACTIVE_QUEUE,
+        task_default_priority=PRIORITY_NORMAL,
+        task_routes=TASK_ROUTES,
+        broker_transport_options={
+            "priority_steps": list(range(PRIORITY_HIGH, PRIORITY_LOW + 1)),
+            "sep": ":",
+            "queue_order_strategy": "priority",
+            "visibility_timeout": VISIBILITY_TIMEOUT,
+        },
+        # Long tasks must not be reserved by a busy worker process while another sits idle
+        worker_prefetch_multiplier=WORKER_PREFETCH_MULTIPLIER,
+    )
+    return app
@@ -1,38 +1,35 @@
-import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import sys
 
-# Assuming DATABASE_URL is accessible or defined similar to app.models
-DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://user:password@db:5432/loraforge_db")
+from alembic import command
+from sqlalchemy import MetaData, create_engine
 
-def clear_database_tables():
-    """
-    Connects to the PostgreSQL database and drops specified tables.
+from app.migrate import DATABASE_URL, alembic_config
+
+def clear_database_tables(url: str = DATABASE_URL, recreate: bool = True):
     """
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = SessionLocal()
+    Drops every table in the database, including `alembic_version`, then (unless
+    `recreate` is False) runs `alembic upgrade head` to build an empty schema.
 
+    Tables are reflected rather than listed, so this also recovers databases left
+    half-dropped by an earlier run. Files under /data/datasets are not touched.
+    """
+    engine = create_engine(url)
     try:
-        # Tables to drop. Order matters if not using CASCADE.
-        # Dropping 'datasets' with CASCADE will also drop 'images'.
-        tables_to_drop = ["datasets"]
-
-        for table_name in tables_to_drop:
-            print(f"Dropping table: {table_name}...")
-            db.execute(text(f"DROP TABLE IF EXISTS {table_name} CASCADE;"))
-            print(f"Table {table_name} dropped successfully.")
-        
-        db.commit()
+        metadata = MetaData()
+        metadata.reflect(bind=engine)
+        print(f"Dropping tables: {', '.join(sorted(metadata.tables)) or '(none)'}...")
+        metadata.drop_all(bind=engine)
         print("Database tables dropped successfully.")
-
-    except Exception as e:
-        db.rollback()
-        print(f"An error occurred: {e}")
-        print("Database rollback performed.")
     finally:
-        db.close()
+        engine.dispose()
         print("Database connection closed.")
 
+    if recreate:
+        print("Recreating schema with 'alembic upgrade head'...")
+        command.upgrade(alembic_config(url), "head")
+        print("Schema recreated.")
+    else:
+        print("Run 'alembic upgrade head' before starting the API again.")
+
 if __name__ == "__main__":
-    clear_database_tables()
\ No newline at end of file
+    clear_database_tables(recreate="--drop-only" not in sys.argv[1:])
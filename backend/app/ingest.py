@@ -0,0 +1,255 @@
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import tempfile
+import uuid
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.archives import ArchiveMember
+from app.metrics import StageTimer
+from app.models import Image
+from app.storage import COPY_CHUNK_SIZE, hash_file
+
+logger = logging.getLogger(__name__)
+
+# Define allowed MIME types and extensions
+ALLOWED_MIME_TYPES = (
+    'image/',    # Matches any image MIME type (e.g., image/jpeg, image/png)
+    'video/',    # Matches any video MIME type (e.g., video/mp4, video/webm)
+    'text/plain' # Matches plain text files
+)
+ALLOWED_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', # Image extensions
+    '.mp4', '.avi', '.mov', '.mkv', '.webm', # Video extensions
+    '.txt' # Text extensions
+)
+
+# Image rows added per commit
+INSERT_BATCH_SIZE = int(os.environ.get("INGEST_INSERT_BATCH_SIZE", "500"))
+# Re-ingested files up to this size are compared in memory; larger ones spill to a temp file
+COMPARE_SPOOL_MAX_BYTES = int(os.environ.get("INGEST_COMPARE_SPOOL_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+@dataclass
+class ExtractedFile:
+    relative_path: str # Path relative to the dataset directory, '/'-separated
+    size: int
+    content_hash: str
+    image_id: object = None # Set by store_files once the file has an Image row
+
+
+@dataclass
+class KnownFile:
+    image_id: object
+    size: Optional[int]
+    content_hash: Optional[str]
+    backfilled: bool = False # size/content_hash were filled in during extraction and should be saved
+
+
+def safe_member_path(name: str) -> Optional[str]:
+    """Normalizes an archive member name, or returns None if it would escape the dataset directory."""
+    path = posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+    if path in ("", ".") or path == ".." or path.startswith("../"):
+        return None
+    return path
+
+
+def copy_and_hash(stream: BinaryIO, out: BinaryIO) -> Tuple[int, str]:
+    """Streams `stream` into the open file `out`, returning the byte count and hex SHA-256."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b""):
+        digest.update(chunk)
+        out.write(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
+def write_and_hash(stream: BinaryIO, dest_path: str) -> Tuple[int, str]:
+    with open(dest_path, "wb") as out:
+        return copy_and_hash(stream, out)
+
+
+def replace_from(source: BinaryIO, dest_path: str):
+    """Atomically replaces `dest_path` with the contents of `source`."""
+    partial_path = dest_path + ".ingest-partial"
+    with open(partial_path, "wb") as out:
+        shutil.copyfileobj(source, out, COPY_CHUNK_SIZE)
+    os.replace(partial_path, dest_path)
+
+
+def extract_members(
+    members: Iterable[ArchiveMember],
+    dataset_dir: str,
+    known_files: Optional[Dict[str, KnownFile]] = None,
+) -> Tuple[List[ExtractedFile], int]:
+    """
+    Writes archive members into `dataset_dir` in a single sequential pass.
+
+    Members whose relative path, size and hash match `known_files` are left
+    untouched on disk and not returned. A size mismatch in the member header is
+    taken as a change without hashing; same-size members are hashed in memory
+    (spilling to a temp file past COMPARE_SPOOL_MAX_BYTES) and only written when
+    they differ, so the disk cost follows the delta rather than the archive.
+    Members whose names normalize to the same path (an appended tar, or `a.png`
+    next to `./a.png`) yield one file; as with tar, the last entry wins.
+    Returns (new or changed files, skipped count).
+    """
+    known_files = known_files or {}
+    # relative_path -> ExtractedFile, or None when the member matched its known file
+    results: Dict[str, Optional[ExtractedFile]] = {}
+    created_dirs = set()
+    for member in members:
+        relative_path = safe_member_path(member.name)
+        if relative_path is None:
+            logger.warning(f"Skipping archive member with unsafe path: {member.name}")
+            continue
+
+        dest_path = os.path.join(dataset_dir, relative_path)
+        parent = os.path.dirname(dest_path)
+        if parent not in created_dirs:
+            os.makedirs(parent, exist_ok=True)
+            created_dirs.add(parent)
+
+        known = known_files.get(relative_path)
+        if results.get(relative_path) is not None:
+            known = None # An earlier entry already replaced the file; compare against nothing
+        if known is None:
+            size, content_hash = write_and_hash(member.stream, dest_path)
+        elif known.size is not None and member.size is not None and member.size != known.size:
+            # The header already shows a change; stream next to the old file and swap it in
+            partial_path = dest_path + ".ingest-partial"
+            size, content_hash = write_and_hash(member.stream, partial_path)
+            os.replace(partial_path, dest_path)
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=COMPARE_SPOOL_MAX_BYTES, dir=parent) as spool:
+                size, content_hash = copy_and_hash(member.stream, spool)
+                stored_hash = known.content_hash
+                if stored_hash is None and known.size in (None, size) and os.path.exists(dest_path):
+                    stored_hash = hash_file(dest_path) # Rows ingested before hashes were recorded
+                    if stored_hash == content_hash:
+                        known.size, known.content_hash, known.backfilled = size, content_hash, True
+                if known.size in (None, size) and content_hash == stored_hash:
+                    results[relative_path] = None
+                    continue
+                spool.seek(0)
+                replace_from(spool, dest_path)
+        results.pop(relative_path, None)
+        results[relative_path] = ExtractedFile(relative_path=relative_path, size=size, content_hash=content_hash)
+    extracted = [f for f in results.values() if f is not None]
+    return extracted, len(results) - len(extracted)
+
+
+def probe_file(full_path: str) -> Tuple[bool, Optional[str], Optional[int], Optional[int]]:
+    """Returns (allowed, mime_type, width, height) for a file on disk."""
+    # Imported here so processes that never probe (API, deletion and caption workers) skip libmagic and Pillow
+    import magic # for file type detection
+    from PIL import Image as PILImage # Use an alias to avoid conflict with Image model
+
+    filename = os.path.basename(full_path)
+    mime_type = None
+    try:
+        mime_type = magic.from_file(full_path, mime=True)
+    except Exception as e:
+        logger.warning(f"Could not detect MIME type for {full_path}: {e}")
+
+    is_allowed_mime = any(mime_type and mime_type.startswith(t) for t in ALLOWED_MIME_TYPES)
+    is_allowed_extension = filename.lower().endswith(ALLOWED_EXTENSIONS)
+    if not (is_allowed_mime or is_allowed_extension):
+        return False, mime_type, None, None
+
+    width, height = None, None
+    # Try to get dimensions only for images
+    if mime_type and mime_type.startswith('image/'):
+        try:
+            with PILImage.open(full_path) as img:
+                width, height = img.size
+        except Exception as e:
+            logger.warning(f"Could not extract dimensions for {filename} using Pillow: {e}")
+    return True, mime_type, width, height
+
+
+def load_known_files(db: Session, dataset_id) -> Dict[str, KnownFile]:
+    rows = (
+        db.query(Image.id, Image.path, Image.size_bytes, Image.content_hash)
+        .filter(Image.dataset_id == dataset_id)
+        .all()
+    )
+    return {path: KnownFile(image_id=image_id, size=size, content_hash=content_hash) for image_id, path, size, content_hash in rows}
+
+
+def backfill_known_files(db: Session, known_files: Dict[str, KnownFile]) -> int:
+    """Saves sizes and hashes computed for legacy rows, so later re-ingests can skip them without hashing."""
+    backfilled = [known for known in known_files.values() if known.backfilled]
+    for i, known in enumerate(backfilled, 1):
+        db.query(Image).filter(Image.id == known.image_id).update(
+            {"size_bytes": known.size, "content_hash": known.content_hash}, synchronize_session=False
+        )
+        if i % INSERT_BATCH_SIZE == 0:
+            db.commit()
+    db.commit()
+    return len(backfilled)
+
+
+def store_files(
+    db: Session,
+    dataset_id,
+    dataset_dir: str,
+    files: List[ExtractedFile],
+    known_files: Optional[Dict[str, KnownFile]] = None,
+    timer: Optional[StageTimer] = None,
+) -> Dict[str, int]:
+    """
+    Probes extracted files and inserts (or, for changed files, updates) their Image rows.
+    Time is split between the "probe" and "insert" stages of `timer`.
+    """
+    known_files = known_files or {}
+    timer = timer or StageTimer("store_files")
+    counts = {"added": 0, "updated": 0, "unsupported": 0}
+    pending = 0
+    for extracted in files:
+        full_path = os.path.join(dataset_dir, extracted.relative_path)
+        with timer.stage("probe"):
+            allowed, mime_type, width, height = probe_file(full_path)
+        if not allowed:
+            logger.info(f"Skipping unsupported file: {extracted.relative_path} (MIME: {mime_type})")
+            counts["unsupported"] += 1
+            continue
+
+        values = dict(
+            width=width,
+            height=height,
+            mime_type=mime_type,
+            size_bytes=extracted.size,
+            content_hash=extracted.content_hash,
+            mtime_ns=os.stat(full_path).st_mtime_ns,
+        )
+        known = known_files.get(extracted.relative_path)
+        with timer.stage("insert"):
+            if known is not None:
+                db.query(Image).filter(Image.id == known.image_id).update(values, synchronize_session=False)
+                extracted.image_id = known.image_id
+                counts["updated"] += 1
+            else:
+                extracted.image_id = uuid.uuid4()
+                db.add(Image(
+                    id=extracted.image_id,
+                    dataset_id=dataset_id,
+                    filename=posixpath.basename(extracted.relative_path),
+                    path=extracted.relative_path,
+                    **values,
+                ))
+                counts["added"] += 1
+
+            pending += 1
+            if pending >= INSERT_BATCH_SIZE:
+                db.commit()
+                pending = 0
+    with timer.stage("insert"):
+        db.commit()
+    return counts
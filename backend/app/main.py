@@ -1,19 +1,18 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Request, Response
 from typing import Optional, List
 import shutil
 import uuid
 import os
 import logging
+import time
 from datetime import datetime
-from contextlib import asynccontextmanager
 
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
 from app.models import (
-    Base, # Import Base for metadata
-    engine, # Import engine for create_all
     get_db,
+    pool_status,
     Dataset,
     Image,
     DatasetResponse,
@@ -22,31 +21,45 @@ from app.models import (
     BackgroundTask,
     BackgroundTaskCreate,
     BackgroundTaskResponse,
+    CaptionRequest,
     TaskStatus
 )
 
+from app.metrics import CONTENT_TYPE_LATEST, HTTP_REQUEST_SECONDS, render_latest
+
 from celery import Celery
+from app.celery_config import configure_celery
+from app.storage import archive_suffix
 
 celery_app = Celery('backend', broker='redis://redis:6379/0')
+configure_celery(celery_app) # Routes tasks to their queues with their priorities
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def create_db_and_tables():
-    logger.info("Creating database tables...")
-    Base.metadata.create_all(engine)
-    logger.info("Database tables created.")
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    print("Creating tables..")
-    create_db_and_tables()
-    yield
+# Schema is managed by Alembic (`alembic upgrade head`), not created at startup
+app = FastAPI()
 
-app = FastAPI(lifespan=lifespan)
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=str(status_code),
+        ).observe(time.perf_counter() - start)
 
 UPLOAD_DIR = "/data/uploads"
+DATASETS_DIR = "/data/datasets"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
@@ -58,6 +71,15 @@ async def read_root():
 async def health_check():
     return {"status": "OK"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/health/db-pool")
+async def db_pool_status():
+    # Per-process: each API worker process has its own pool
+    return pool_status()
+
 @app.post("/v1/datasets/", response_model=BackgroundTaskResponse, status_code=status.HTTP_202_ACCEPTED)
 async def upload_dataset(
     request: Request,
@@ -71,7 +93,7 @@ async def upload_dataset(
 
     # Save the uploaded file to a temporary directory
     original_filename = file.filename
-    file_extension = os.path.splitext(original_filename)[1]
+    file_extension = archive_suffix(original_filename) # Keeps ".tar.gz" intact for the worker
     unique_temp_filename = f"{uuid.uuid4()}{file_extension}"
     temp_file_path = os.path.join(UPLOAD_DIR, unique_temp_filename)
 
@@ -119,11 +141,102 @@ async def upload_dataset(
     finally:
         await file.close()
 
+@app.post("/v1/datasets/{dataset_id}/files", response_model=BackgroundTaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def add_files_to_dataset(
+    dataset_id: uuid.UUID,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db)
+):
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.deleted_at.is_(None)).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    original_filename = file.filename
+    file_extension = archive_suffix(original_filename)
+    temp_file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}{file_extension}")
+
+    try:
+        with open(temp_file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        logger.info(f"Uploaded archive for dataset {dataset_id} saved to {temp_file_path}")
+
+        task_id = uuid.uuid4()
+        now = datetime.utcnow()
+        db_task = BackgroundTask(
+            id=task_id,
+            task_name="add_files_to_dataset",
+            status=TaskStatus.PENDING.value,
+            progress=0,
+            result=f"Adding files to dataset '{dataset.name}' (filename: {original_filename}, temp_path: {temp_file_path})",
+            created_at=now,
+            updated_at=now
+        )
+        db.add(db_task)
+        db.commit()
+        db.refresh(db_task)
+
+        task = celery_app.send_task(
+            "worker.app.worker.add_files_to_dataset",
+            args=[str(task_id), str(dataset_id), temp_file_path, original_filename]
+        )
+        logger.info(f"Celery task enqueued with ID: {task.id}")
+        return db_task
+    except Exception as e:
+        logger.error(f"Error adding files to dataset {dataset_id}: {e}")
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise HTTPException(status_code=500, detail=f"Could not add files to dataset: {e}")
+    finally:
+        await file.close()
+
 @app.get("/v1/datasets/", response_model=DatasetsResponse)
 async def get_all_datasets(db: Session = Depends(get_db)):
-    datasets = db.query(Dataset).all()
+    datasets = db.query(Dataset).filter(Dataset.deleted_at.is_(None)).all()
     return DatasetsResponse(root=datasets)
 
+@app.delete("/v1/datasets/{dataset_id}", response_model=BackgroundTaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def delete_dataset(dataset_id: uuid.UUID, db: Session = Depends(get_db)):
+    # Rows already marked deleted are still accepted, so a deletion that failed (or was never
+    # queued) can be retried; the worker's removal steps are idempotent.
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    # Hide the dataset right away; files and image rows are removed by the worker
+    task_id = uuid.uuid4()
+    now = datetime.utcnow()
+    retrying = dataset.deleted_at is not None
+    if not retrying:
+        dataset.deleted_at = now
+    db_task = BackgroundTask(
+        id=task_id,
+        task_name="delete_dataset",
+        status=TaskStatus.PENDING.value,
+        progress=0,
+        result=f"{'Retrying deletion of' if retrying else 'Deleting'} dataset '{dataset.name}'",
+        created_at=now,
+        updated_at=now
+    )
+    db.add(dataset)
+    db.add(db_task)
+    db.commit()
+    db.refresh(db_task)
+
+    try:
+        task = celery_app.send_task(
+            "worker.app.worker.delete_dataset",
+            args=[str(task_id), str(dataset_id)]
+        )
+    except Exception as e:
+        logger.error(f"Could not enqueue deletion of dataset {dataset_id}: {e}", exc_info=True)
+        db_task.status = TaskStatus.FAILURE.value
+        db_task.result = f"Could not enqueue deletion: {e}"
+        db.add(db_task)
+        db.commit()
+        raise HTTPException(status_code=503, detail="Could not enqueue deletion; retry the request")
+    logger.info(f"Deletion task enqueued with ID: {task.id} for dataset {dataset_id}")
+    return db_task
+
 @app.get("/v1/tasks/{task_id}/status", response_model=BackgroundTaskResponse)
 async def get_task_status(task_id: uuid.UUID, db: Session = Depends(get_db)):
     task = db.query(BackgroundTask).filter(BackgroundTask.id == task_id).first()
@@ -133,18 +246,51 @@ async def get_task_status(task_id: uuid.UUID, db: Session = Depends(get_db)):
 
 @app.get("/v1/datasets/{dataset_id}/images/", response_model=ImagesResponse)
 async def get_images_for_dataset(dataset_id: uuid.UUID, db: Session = Depends(get_db)):
-    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.deleted_at.is_(None)).first()
     if not dataset:
         raise HTTPException(status_code=404, detail="Dataset not found")
     
     images = db.query(Image).filter(Image.dataset_id == dataset_id).all()
     return ImagesResponse(root=images)
 
+@app.post("/v1/datasets/{dataset_id}/captions", response_model=BackgroundTaskResponse, status_code=status.HTTP_202_ACCEPTED)
+async def caption_dataset(dataset_id: uuid.UUID, caption_request: CaptionRequest, db: Session = Depends(get_db)):
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id, Dataset.deleted_at.is_(None)).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    task_id = uuid.uuid4()
+    now = datetime.utcnow()
+    db_task = BackgroundTask(
+        id=task_id,
+        task_name="caption_dataset_images",
+        status=TaskStatus.PENDING.value,
+        progress=0,
+        result=f"Captioning dataset '{dataset.name}' ({caption_request.prompt_style.value})",
+        created_at=now,
+        updated_at=now
+    )
+    db.add(db_task)
+    db.commit()
+    db.refresh(db_task)
+
+    task = celery_app.send_task(
+        "worker.app.worker.caption_dataset_images",
+        args=[str(task_id), str(dataset_id), caption_request.prompt_style.value, caption_request.model, caption_request.overwrite_sidecars]
+    )
+    logger.info(f"Captioning task enqueued with ID: {task.id} for dataset {dataset_id}")
+    return db_task
+
 from fastapi.responses import FileResponse # Added import here
 
 @app.get("/v1/images/{image_id}/file")
 async def get_image_file(image_id: uuid.UUID, db: Session = Depends(get_db)):
-    image = db.query(Image).filter(Image.id == image_id).first()
+    image = (
+        db.query(Image)
+        .join(Dataset)
+        .filter(Image.id == image_id, Dataset.deleted_at.is_(None))
+        .first()
+    )
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
@@ -153,7 +299,7 @@ async def get_image_file(image_id: uuid.UUID, db: Session = Depends(get_db)):
     # From ARCHITECTURE.md: /data/datasets/{dataset_id}/
     # From app/worker.py: target_unpack_dir = /data/datasets/{dataset_id}
     # And image.path is relative to target_unpack_dir
-    dataset_path = os.path.join("/data/datasets", str(image.dataset_id))
+    dataset_path = os.path.join(DATASETS_DIR, str(image.dataset_id))
     image_full_path = os.path.join(dataset_path, image.path)
 
     if not os.path.exists(image_full_path):
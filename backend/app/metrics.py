@@ -0,0 +1,172 @@
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# In multiprocess mode (Celery prefork, several API workers) every process writes its samples
+# under this directory and the exporter aggregates them. It must exist before prometheus_client
+# creates any metric.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Held by the process that owns PROMETHEUS_MULTIPROC_DIR; see reset_multiproc_dir
+MULTIPROC_LOCK_FILENAME = ".owner.lock"
+_multiproc_lock = None
+
+# Ingest stages take anywhere from milliseconds (tiny archives) to hours
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 10800)
+
+TASK_STAGE_SECONDS = Histogram(
+    "loraforge_task_stage_seconds",
+    "Wall time spent in each stage of a background task.",
+    ["task", "stage"],
+    buckets=STAGE_BUCKETS,
+)
+TASK_FILES_TOTAL = Counter(
+    "loraforge_task_files_total",
+    "Files processed by background tasks.",
+    ["task"],
+)
+TASK_BYTES_TOTAL = Counter(
+    "loraforge_task_bytes_total",
+    "Bytes of file content processed by background tasks.",
+    ["task"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "loraforge_http_request_seconds",
+    "API request latency by route template.",
+    ["method", "route", "status"],
+)
+
+
+# Checkouts normally return at once; anything near DB_POOL_TIMEOUT (30 s) means the pool is too small
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "loraforge_db_pool_wait_seconds",
+    "Time a checkout waited for a pooled database connection, by outcome (acquired or timeout).",
+    ["engine", "outcome"],
+    buckets=POOL_WAIT_BUCKETS,
+)
+# Summed over live processes, so a prefork worker reports the connections all its children hold
+DB_POOL_CONNECTIONS = Gauge(
+    "loraforge_db_pool_connections",
+    "Pooled database connections by state (checked_out, checked_in, overflow).",
+    ["engine", "state"],
+    multiprocess_mode="livesum",
+)
+
+
+def observe_pool_checkout(engine: str, seconds: float, timed_out: bool = False):
+    DB_POOL_WAIT_SECONDS.labels(engine=engine, outcome="timeout" if timed_out else "acquired").observe(seconds)
+
+
+def publish_pool_state(engine: str, checked_out: int, checked_in: int, overflow: int):
+    DB_POOL_CONNECTIONS.labels(engine=engine, state="checked_out").set(checked_out)
+    DB_POOL_CONNECTIONS.labels(engine=engine, state="checked_in").set(checked_in)
+    DB_POOL_CONNECTIONS.labels(engine=engine, state="overflow").set(overflow)
+
+
+class StageTimer:
+    """
+    Accumulates wall time per named stage for one task run. A stage may be entered
+    many times (e.g. once per file); each total is observed once on `finish()`.
+    """
+
+    def __init__(self, task_name: str):
+        self.task_name = task_name
+        self.stages = defaultdict(float)
+        self.files = 0
+        self.bytes = 0
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def count(self, files: int = 0, size: int = 0):
+        self.files += files
+        self.bytes += size
+
+    def finish(self) -> dict:
+        """Publishes the run to Prometheus and returns a summary suitable for BackgroundTask.result."""
+        total = time.perf_counter() - self._started
+        for name, seconds in self.stages.items():
+            TASK_STAGE_SECONDS.labels(task=self.task_name, stage=name).observe(seconds)
+        TASK_FILES_TOTAL.labels(task=self.task_name).inc(self.files)
+        TASK_BYTES_TOTAL.labels(task=self.task_name).inc(self.bytes)
+        return {
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "total_seconds": round(total, 4),
+            "files": self.files,
+            "bytes": self.bytes,
+            "files_per_second": round(self.files / total, 2) if total > 0 else None,
+            "bytes_per_second": round(self.bytes / total, 2) if total > 0 else None,
+        }
+
+
+def export_registry():
+    """Registry to expose: aggregated across processes in multiprocess mode, else the default one."""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_latest() -> bytes:
+    return generate_latest(export_registry())
+
+
+def start_exporter(port: int):
+    """Serves /metrics on `port` from a background thread (used by the Celery worker)."""
+    start_http_server(port, registry=export_registry())
+
+
+def reset_multiproc_dir() -> bool:
+    """
+    Deletes sample files left in PROMETHEUS_MULTIPROC_DIR by earlier runs, which the exporter
+    would otherwise keep summing into the counters. Call once in the parent process before any
+    child forks. Returns False, leaving the files alone, if another running process holds the
+    directory.
+    """
+    global _multiproc_lock
+    if not PROMETHEUS_MULTIPROC_DIR or _multiproc_lock is not None:
+        return False
+    import fcntl
+
+    lock = open(os.path.join(PROMETHEUS_MULTIPROC_DIR, MULTIPROC_LOCK_FILENAME), "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    # Kept open for the life of the process; forked children inherit it, so the lock is only
+    # released once the whole worker has exited
+    _multiproc_lock = lock
+    for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+        if name.endswith(".db"):
+            os.unlink(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+    return True
+
+
+def mark_process_dead(pid: int):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,52 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+
+# Assuming DATABASE_URL is accessible or defined similar to app.models
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://user:password@db:5432/loraforge_db")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Databases created before Alembic was introduced have exactly the tables of this revision
+BASELINE_REVISION = "0001"
+BASELINE_TABLES = {"datasets", "images", "background_tasks"}
+
+def alembic_config(url: str = DATABASE_URL) -> Config:
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BACKEND_DIR, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    return config
+
+def stamp_legacy_database(url: str = DATABASE_URL) -> bool:
+    """
+    Marks a database bootstrapped by the old startup `create_all` as being at the baseline
+    revision, so `upgrade head` migrates it instead of failing to recreate its tables.
+    Returns True if it stamped.
+    """
+    engine = create_engine(url)
+    try:
+        tables = set(inspect(engine).get_table_names())
+    finally:
+        engine.dispose()
+    if "alembic_version" in tables or not tables & BASELINE_TABLES:
+        return False
+    missing = BASELINE_TABLES - tables
+    if missing:
+        raise RuntimeError(
+            f"Database has some but not all baseline tables (missing: {', '.join(sorted(missing))}) "
+            "and no alembic_version; refusing to guess its revision"
+        )
+    command.stamp(alembic_config(url), BASELINE_REVISION)
+    return True
+
+def upgrade_database(url: str = DATABASE_URL):
+    """Brings the schema to the latest revision. The backend container runs this before starting the API."""
+    if stamp_legacy_database(url):
+        print(f"Existing tables without alembic_version found; stamped revision {BASELINE_REVISION}.")
+    command.upgrade(alembic_config(url), "head")
+    print("Database schema is up to date.")
+
+if __name__ == "__main__":
+    upgrade_database()
@@ -1,16 +1,30 @@
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, ForeignKey, UUID, Text
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Mapped
+from sqlalchemy import create_engine, Column, String, Integer, BigInteger, DateTime, ForeignKey, UUID, Text, UniqueConstraint, Index
+from sqlalchemy.orm import Session, sessionmaker, declarative_base, relationship, Mapped
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.sql import func
 from datetime import datetime
 import os
+import threading
+import time
 import uuid
 from enum import Enum
 from typing import Optional, List
 from pydantic import BaseModel, RootModel
 
+from app.metrics import observe_pool_checkout, publish_pool_state
+
 # Database connection string from environment variable
 DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://user:password@db:5432/loraforge_db")
 
+# Connection pool sizing. Every process (API worker, Celery prefork child) gets its own pool,
+# so the Postgres connection budget is roughly processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800")) # Seconds; -1 disables recycling
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
 # Create a declarative base for our models
 Base = declarative_base()
 
@@ -21,22 +35,33 @@ class Dataset(Base):
     name = Column(String, nullable=False)
     source_path = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    deleted_at = Column(DateTime(timezone=True), nullable=True) # Set when deletion is requested; hidden from listings
 
-    images = relationship("Image", back_populates="dataset")
+    images = relationship("Image", back_populates="dataset", passive_deletes=True) # Rows are removed by ON DELETE CASCADE
 
     def __repr__(self):
         return f"<Dataset(id={self.id}, name='{self.name}')>"
 
 class Image(Base):
     __tablename__ = "images"
+    __table_args__ = (
+        # Dataset image listing, plus upcoming width/height filters within a dataset
+        Index("ix_images_dataset_id_width_height", "dataset_id", "width", "height"),
+        # Re-ingest matches archive members to rows by path
+        Index("uq_images_dataset_id_path", "dataset_id", "path", unique=True),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    dataset_id = Column(UUID(as_uuid=True), ForeignKey("datasets.id"), nullable=False)
+    dataset_id = Column(UUID(as_uuid=True), ForeignKey("datasets.id", name="images_dataset_id_fkey", ondelete="CASCADE"), nullable=False)
     filename = Column(String, nullable=False)
     path = Column(String, nullable=False) # Relative path within the dataset's originals folder
     width = Column(Integer)
     height = Column(Integer)
     mime_type = Column(String, nullable=True)
+    size_bytes = Column(BigInteger, nullable=True)
+    content_hash = Column(String(64), nullable=True) # SHA-256 of the file, used to skip unchanged files on re-ingest
+    mtime_ns = Column(BigInteger, nullable=True) # File mtime when content_hash was computed; a mismatch means it was edited on disk
+    caption = Column(Text, nullable=True) # Latest generated caption, mirrored to a sidecar .txt file
 
     dataset = relationship("Dataset", back_populates="images")
 
@@ -51,6 +76,9 @@ class TaskStatus(str, Enum):
 
 class BackgroundTask(Base):
     __tablename__ = "background_tasks"
+    __table_args__ = (
+        Index("ix_background_tasks_status_created_at", "status", "created_at"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     task_name = Column(String, nullable=False)
@@ -63,6 +91,26 @@ class BackgroundTask(Base):
     def __repr__(self):
         return f"<BackgroundTask(id={self.id}, name='{self.task_name}', status='{self.status}', progress={self.progress})>"
 
+class PromptStyle(str, Enum):
+    SDXL = "SDXL"
+    FLUX = "FLUX"
+
+class CaptionCache(Base):
+    __tablename__ = "caption_cache"
+    __table_args__ = (
+        UniqueConstraint("content_hash", "prompt_style", "model", name="uq_caption_cache_key"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    content_hash = Column(String(64), nullable=False) # SHA-256 of the image file contents
+    prompt_style = Column(String, nullable=False) # SDXL, FLUX
+    model = Column(String, nullable=False)
+    caption = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<CaptionCache(hash='{self.content_hash[:12]}', style='{self.prompt_style}', model='{self.model}')>"
+
 # Pydantic models for API requests and responses
 class DatasetInput(BaseModel):
     name: str
@@ -85,6 +133,7 @@ class ImageResponse(BaseModel):
     width: Optional[int] = None
     height: Optional[int] = None
     mime_type: Optional[str] = None # Add MIME type to Pydantic model
+    caption: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -110,10 +159,155 @@ class BackgroundTaskCreate(BaseModel):
     progress: Optional[int] = 0
     result: Optional[str] = None
 
+class CaptionRequest(BaseModel):
+    prompt_style: PromptStyle = PromptStyle.SDXL
+    model: Optional[str] = None # Falls back to CAPTION_MODEL when omitted
+    overwrite_sidecars: bool = False # Replace .txt sidecars that did not come from an earlier captioning run
+
+
+class PoolMetrics:
+    """Counters for time one pool spent waiting for connections, for /health/db-pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a free connection, both in
+    its own `metrics` and as Prometheus series labelled with `engine_name`.
+    """
+
+    engine_name = "default"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # dispose() swaps in a fresh pool (with fresh metrics); keep reporting under the same name
+        pool = super().recreate()
+        pool.engine_name = self.engine_name
+        return pool
+
+    def _publish_state(self):
+        publish_pool_state(self.engine_name, self.checkedout(), self.checkedin(), max(self.overflow(), 0))
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            waited = time.perf_counter() - start
+            self.metrics.record_wait(waited, timed_out=True)
+            observe_pool_checkout(self.engine_name, waited, timed_out=True)
+            raise
+        waited = time.perf_counter() - start
+        self.metrics.record_wait(waited)
+        observe_pool_checkout(self.engine_name, waited)
+        self._publish_state()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._publish_state()
+
+def build_engine(
+    url: str = DATABASE_URL,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW,
+    pool_timeout: float = DB_POOL_TIMEOUT,
+    pool_recycle: int = DB_POOL_RECYCLE,
+    pool_pre_ping: bool = DB_POOL_PRE_PING,
+    name: str = "default",
+):
+    """`name` labels the engine's pool metrics, to tell engines in one process apart."""
+    if url.rstrip("/") == "sqlite:" or ":memory:" in url:
+        # In-memory SQLite is per-connection; let SQLAlchemy pick its default pool
+        return create_engine(url)
+    engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+    )
+    engine.pool.engine_name = name
+    return engine
+
+# The application engine is built on first use rather than at import: importing models
+# stays cheap, and a prefork parent that never queries never opens a pool its children inherit.
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_engine()
+    return _engine
+
+def __getattr__(name):
+    # Keeps `from app.models import engine` working while deferring creation
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def pool_status(bind=None) -> dict:
+    """Snapshot of pool usage for the current process."""
+    pool = (bind or get_engine()).pool
+    status = {"pool_class": type(pool).__name__}
+    if isinstance(pool, InstrumentedQueuePool):
+        metrics = pool.metrics
+        status.update({
+            "engine": pool.engine_name,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0), # Negative while the pool is still filling up
+            "max_overflow": pool._max_overflow,
+            "checkouts": metrics.checkouts,
+            "timeouts": metrics.timeouts,
+            "wait_seconds_total": round(metrics.wait_seconds_total, 6),
+            "wait_seconds_max": round(metrics.wait_seconds_max, 6),
+        })
+    return status
+
+def dispose_engine_after_fork():
+    """
+    Drops pooled connections inherited from a parent process without closing them,
+    so a forked child never shares a socket with its parent. Call from the child.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False) # The replacement pool starts with its own, empty metrics
+
+class LazyEngineSession(Session):
+    """Session that binds to the application engine the first time it needs a connection."""
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
 
-# Create the engine, sessionmaker, and Base metadata
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=LazyEngineSession, autocommit=False, autoflush=False)
 
 def get_db():
     db = SessionLocal()
@@ -122,9 +316,9 @@ def get_db():
     finally:
         db.close()
 
-# Function to create tables (for initial setup or testing)
+# Function to create tables (for testing; deployments use `alembic upgrade head`)
 def create_db_tables():
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
 
 if __name__ == "__main__":
     print("Creating database tables...")
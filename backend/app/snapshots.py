@@ -0,0 +1,218 @@
+"""
+Columnar snapshots of a dataset's image metadata.
+
+Each dataset directory holds an Arrow IPC file mirroring its `Image` rows. Analytics
+code memory-maps it and reads numeric columns as NumPy arrays that point straight into
+the mapped file, so scanning a large dataset never goes through the ORM or Postgres.
+The database stays the source of truth; the snapshot is rebuilt from it whenever the
+dataset changes and can always be regenerated.
+"""
+import logging
+import os
+import tempfile
+import uuid
+from typing import Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Image
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = ".metadata.arrow"
+SNAPSHOT_FORMAT_VERSION = "1"
+
+# Ids per IN clause when fetching changed rows
+SNAPSHOT_QUERY_CHUNK_SIZE = 500
+
+# Missing integers are stored as 0 so every numeric column is null-free and can be
+# mapped without copying. caption_length doubles as a "has caption" flag.
+NUMERIC_COLUMNS = ("width", "height", "size_bytes", "caption_length")
+
+
+def snapshot_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, SNAPSHOT_FILENAME)
+
+
+def _schema(dataset_id):
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("path", pa.string()),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+            ("size_bytes", pa.int64()),
+            ("mime_type", pa.dictionary(pa.int32(), pa.string())),
+            ("caption_length", pa.int32()),
+        ],
+        metadata={"format_version": SNAPSHOT_FORMAT_VERSION, "dataset_id": str(dataset_id)},
+    )
+
+
+def _query_rows(db: Session, dataset_id, image_ids: Optional[List] = None) -> List[tuple]:
+    query = db.query(
+        Image.id, Image.path, Image.width, Image.height, Image.size_bytes, Image.mime_type,
+        func.coalesce(func.length(Image.caption), 0),
+    ).filter(Image.dataset_id == dataset_id)
+    if image_ids is None:
+        return query.all()
+    rows = []
+    for i in range(0, len(image_ids), SNAPSHOT_QUERY_CHUNK_SIZE):
+        rows.extend(query.filter(Image.id.in_(image_ids[i:i + SNAPSHOT_QUERY_CHUNK_SIZE])).all())
+    return rows
+
+
+def _rows_to_table(rows: List[tuple], schema):
+    import pyarrow as pa
+
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    ids, paths, widths, heights, sizes, mime_types, caption_lengths = columns
+    return pa.table(
+        [
+            pa.array([str(image_id) for image_id in ids], pa.string()),
+            pa.array(paths, pa.string()),
+            pa.array([w or 0 for w in widths], pa.int32()),
+            pa.array([h or 0 for h in heights], pa.int32()),
+            pa.array([s or 0 for s in sizes], pa.int64()),
+            # Unknown types become their own category so the codes stay null-free
+            pa.array(mime_types, pa.string()).dictionary_encode(null_encoding="encode").cast(schema.field("mime_type").type),
+            pa.array(caption_lengths, pa.int32()),
+        ],
+        schema=schema,
+    )
+
+
+def _read_existing(path: str, dataset_id):
+    """Loads the current snapshot into memory, or returns None if it is missing or unusable."""
+    import pyarrow as pa
+
+    if not os.path.exists(path):
+        return None
+    try:
+        # The mapping outlives os.replace of the file, so the table stays valid while rewriting
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"Ignoring unreadable metadata snapshot {path}: {e}")
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(b"format_version") != SNAPSHOT_FORMAT_VERSION.encode() \
+            or metadata.get(b"dataset_id") != str(dataset_id).encode() \
+            or not table.schema.equals(_schema(dataset_id)):
+        return None
+    return table
+
+
+def _single_chunk(column):
+    # combine_chunks copies even a lone chunk; snapshots are written as one batch
+    return column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+
+
+def _write_atomic(path: str, table):
+    import pyarrow as pa
+
+    # A private temp file per writer: ingest and captioning workers may refresh the same dataset at once
+    fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=SNAPSHOT_FILENAME, suffix=".partial")
+    try:
+        os.fchmod(fd, 0o644) # mkstemp creates 0600; readers may run as another user
+    finally:
+        os.close(fd)
+    try:
+        with pa.OSFile(partial_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                # A single record batch keeps every column in one contiguous buffer
+                writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+        # Readers holding the old file mapped keep seeing the old inode; the last writer wins
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.unlink(partial_path)
+        raise
+
+
+def refresh_snapshot(db: Session, dataset_id, dataset_dir: str, changed_ids: Optional[Iterable] = None) -> int:
+    """
+    Rewrites the dataset's metadata snapshot and returns its row count.
+
+    With `changed_ids`, only those rows are re-read from the database and spliced into
+    the existing snapshot. It falls back to a full rebuild when there is no usable
+    snapshot or the row count no longer matches the database.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    dataset_id = dataset_id if isinstance(dataset_id, uuid.UUID) else uuid.UUID(str(dataset_id))
+    schema = _schema(dataset_id)
+    path = snapshot_path(dataset_dir)
+
+    table = None
+    if changed_ids is not None:
+        existing = _read_existing(path, dataset_id)
+        if existing is not None:
+            changed_ids = list(changed_ids)
+            keep = pc.invert(pc.is_in(existing["id"], value_set=pa.array([str(i) for i in changed_ids], pa.string())))
+            changed = _rows_to_table(_query_rows(db, dataset_id, changed_ids), schema)
+            table = pa.concat_tables([existing.filter(keep), changed]).unify_dictionaries()
+            expected = db.query(func.count(Image.id)).filter(Image.dataset_id == dataset_id).scalar()
+            if table.num_rows != expected:
+                logger.info(f"Snapshot for dataset {dataset_id} has {table.num_rows} rows, expected {expected}; rebuilding")
+                table = None
+
+    if table is None:
+        table = _rows_to_table(_query_rows(db, dataset_id), schema)
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    _write_atomic(path, table)
+    return table.num_rows
+
+
+class MetadataSnapshot:
+    """A memory-mapped metadata snapshot. Arrays stay valid while this object is referenced."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self) -> List[str]:
+        return self.table.column_names
+
+    def array(self, name: str):
+        """
+        Returns column `name` as a NumPy array.
+
+        Numeric columns are zero-copy views of the mapped file. Dictionary columns
+        (mime_type) return their integer codes, also zero-copy; see `categories`.
+        String columns (id, path) are materialized as object arrays.
+        """
+        column = _single_chunk(self.table.column(name))
+        if name == "mime_type":
+            return column.indices.to_numpy(zero_copy_only=True)
+        if name in NUMERIC_COLUMNS:
+            return column.to_numpy(zero_copy_only=True)
+        return column.to_numpy(zero_copy_only=False)
+
+    def categories(self, name: str = "mime_type") -> List[Optional[str]]:
+        """Values indexed by the codes returned from `array(name)`."""
+        return _single_chunk(self.table.column(name)).dictionary.to_pylist()
+
+
+def open_snapshot(dataset_dir: str) -> Optional[MetadataSnapshot]:
+    """
+    Maps the dataset's snapshot. Returns None if it has not been generated yet or is
+    unreadable; queue `rebuild_dataset_snapshot` to regenerate it.
+    """
+    import pyarrow as pa
+
+    path = snapshot_path(dataset_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        return MetadataSnapshot(pa.ipc.open_file(pa.memory_map(path, "r")).read_all())
+    except (OSError, pa.ArrowException) as e:
+        logger.warning(f"Ignoring unreadable metadata snapshot {path}: {e}")
+        return None
@@ -1,22 +1,39 @@
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+import contextlib
+import functools
 import os
 import uuid
-import zipfile
-from PIL import Image as PILImage # Use an alias to avoid conflict with Image model
-import magic # for file type detection
+import json
 from pathlib import Path
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from app.models import SessionLocal, Dataset, Image, BackgroundTask, TaskStatus
+from app.models import SessionLocal, dispose_engine_after_fork, Dataset, Image, BackgroundTask, TaskStatus, CaptionCache, PromptStyle
+from app.celery_config import configure_celery
+from app.storage import remove_tree_parallel, hash_file, archive_suffix
+from app.metrics import PROMETHEUS_MULTIPROC_DIR, StageTimer, start_exporter, mark_process_dead, reset_multiproc_dir
+from app.archives import SUPPORTED_ARCHIVE_SUFFIXES, iter_archive_members
+from app.ingest import KnownFile, backfill_known_files, extract_members, load_known_files, store_files
+from app.snapshots import refresh_snapshot
+from app.captioning import CaptionClient, CaptionJob, read_sidecar, write_sidecar, CAPTION_MODEL
 
 celery_app = Celery(
     "loraforge_worker",
     include=["app.worker"]
 )
 
+DATASETS_DIR = "/data/datasets"
+# Rows removed per DELETE statement; keeps each transaction (and its locks) short
+DELETE_BATCH_SIZE = int(os.environ.get("DELETE_BATCH_SIZE", "5000"))
+DELETE_UNLINK_WORKERS = int(os.environ.get("DELETE_UNLINK_WORKERS", "8"))
+# Port for the worker's Prometheus exporter; unset disables it
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
 celery_app.conf.update(
     broker_url=os.environ.get("CELERY_BROKER_URL", "redis://redis:6379/0"),
     result_backend=os.environ.get("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
 )
+configure_celery(celery_app)
 
 
 import logging
@@ -28,19 +45,70 @@ task_logger = logging.getLogger(__name__)
 if __name__ == "__main__":
     celery_app.start()
 
-@celery_app.task(name='worker.app.worker.process_dataset_upload')
+@worker_process_init.connect
+def reset_db_pool_in_child(**kwargs):
+    # Prefork children inherit the parent's pooled sockets; give each child its own pool
+    dispose_engine_after_fork()
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    # Runs once in the main worker process; children report through PROMETHEUS_MULTIPROC_DIR
+    if reset_multiproc_dir():
+        task_logger.info("Cleared metric samples left by a previous worker run")
+    elif PROMETHEUS_MULTIPROC_DIR:
+        task_logger.warning(f"PROMETHEUS_MULTIPROC_DIR {PROMETHEUS_MULTIPROC_DIR} is in use by another process; keeping its samples")
+    if WORKER_METRICS_PORT:
+        start_exporter(WORKER_METRICS_PORT)
+        task_logger.info(f"Serving worker metrics on port {WORKER_METRICS_PORT}")
+
+@worker_process_shutdown.connect
+def release_child_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+def with_session(func):
+    """Supplies a task-scoped session (closed afterwards) unless the caller passes `db`."""
+    @functools.wraps(func)
+    def wrapper(*args, db: Session = None, **kwargs):
+        if db is not None:
+            return func(*args, db=db, **kwargs)
+        db = SessionLocal()
+        try:
+            return func(*args, db=db, **kwargs)
+        finally:
+            db.close() # Return the connection to the pool
+    return wrapper
+
+def refresh_metadata_snapshot(db: Session, dataset_id, dataset_dir: str, changed_ids=None, timer: StageTimer = None):
+    """Updates the dataset's columnar snapshot. It is derived data, so failures are logged rather than failing the task."""
+    try:
+        with timer.stage("snapshot") if timer else contextlib.nullcontext():
+            rows = refresh_snapshot(db, dataset_id, dataset_dir, changed_ids)
+        task_logger.info(f"Metadata snapshot for dataset {dataset_id} now has {rows} rows")
+    except Exception as e:
+        task_logger.warning(f"Could not refresh metadata snapshot for dataset {dataset_id}: {e}", exc_info=True)
+
+@celery_app.task(name='worker.app.worker.process_dataset_upload', acks_late=True)
+@with_session
 def process_dataset_upload(task_id: str, temp_file_path: str, original_filename: str, dataset_name: str, db: Session = None):
     task_logger.info(f"Starting 'process_dataset_upload' for task_id: {task_id}, file: {temp_file_path}")
 
-    # If a session is not provided (e.g., when called by Celery), create one
-    if db is None:
-        db = SessionLocal()
-    
     task = db.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).first()
     if not task:
         task_logger.error(f"Background task with ID {task_id} not found.")
         return {"status": "failed", "message": f"Task ID {task_id} not found."}
 
+    if task.status in (TaskStatus.SUCCESS.value, TaskStatus.FAILURE.value):
+        # acks_late redelivers tasks whose worker died after finishing; don't ingest twice
+        task_logger.warning(f"Task {task_id} already finished with status {task.status}; ignoring redelivery")
+        return {"status": "skipped", "message": f"Task {task_id} already finished with status {task.status}."}
+
+    # The dataset takes the task's id, so a redelivered task resumes the same dataset instead of starting another
+    dataset_id = uuid.UUID(task_id)
+    existing_dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if task.status == TaskStatus.RUNNING.value:
+        task_logger.warning(f"Task {task_id} was interrupted; resuming dataset {dataset_id}")
+
+    timer = StageTimer("process_dataset_upload")
     try:
         task.status = TaskStatus.RUNNING.value
         task.progress = 5
@@ -49,6 +117,22 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
         db.commit()
         db.refresh(task)
 
+        if existing_dataset is not None and existing_dataset.deleted_at is not None:
+            task.status = TaskStatus.FAILURE.value
+            task.result = f"Dataset {dataset_id} was deleted while it was being processed."
+            db.add(task)
+            db.commit()
+            return {"status": "failed", "message": task.result}
+
+        if not os.path.exists(temp_file_path) and existing_dataset is not None:
+            # Interrupted after the archive was cleaned up: every file already has its row
+            task.status = TaskStatus.SUCCESS.value
+            task.progress = 100
+            task.result = f"Dataset '{dataset_name}' with ID {dataset_id} processed successfully."
+            db.add(task)
+            db.commit()
+            return {"status": "success", "dataset_id": str(dataset_id), "original_file": temp_file_path}
+
         if not os.path.exists(temp_file_path):
             task_logger.error(f"File not found for processing: {temp_file_path}")
             task.status = TaskStatus.FAILURE.value
@@ -57,8 +141,7 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
             db.commit()
             return {"status": "failed", "message": f"File not found: {temp_file_path}"}
 
-        dataset_id = uuid.uuid4() # Generate a new UUID for the dataset
-        dataset_base_dir = os.path.join("/data/datasets", str(dataset_id))
+        dataset_base_dir = os.path.join(DATASETS_DIR, str(dataset_id))
         # Extract directly into the dataset's root directory, not a nested 'originals'
         target_unpack_dir = dataset_base_dir
 
@@ -72,14 +155,17 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
         db.commit()
         db.refresh(task)
 
-        file_extension = os.path.splitext(temp_file_path)[1].lower()
+        file_extension = archive_suffix(temp_file_path)
         unpacked = False
 
-        if file_extension == '.zip':
-            task_logger.info(f"Unpacking ZIP archive: {temp_file_path} to {target_unpack_dir}")
-            with zipfile.ZipFile(temp_file_path, 'r') as zip_ref:
-                zip_ref.extractall(target_unpack_dir)
-            task_logger.info(f"Successfully unpacked ZIP archive to {target_unpack_dir}")
+        if file_extension in SUPPORTED_ARCHIVE_SUFFIXES:
+            task_logger.info(f"Unpacking {file_extension} archive: {temp_file_path} to {target_unpack_dir}")
+            with timer.stage("unpack"):
+                # On a resumed run, files already stored by the interrupted one are skipped
+                known_files = load_known_files(db, dataset_id) if existing_dataset is not None else None
+                extracted_files, _ = extract_members(iter_archive_members(temp_file_path), target_unpack_dir, known_files)
+            timer.count(files=len(extracted_files), size=sum(f.size for f in extracted_files))
+            task_logger.info(f"Successfully unpacked {file_extension} archive to {target_unpack_dir}")
             unpacked = True
         elif file_extension == '.rar':
             task_logger.warning(
@@ -108,11 +194,12 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
             db.refresh(task)
             
             # Create a new dataset record in the database
-            new_dataset = Dataset(id=dataset_id, name=dataset_name, source_path=temp_file_path)
-            db.add(new_dataset)
-            db.commit()
-            db.refresh(new_dataset)
-            task_logger.info(f"Created dataset record for ID: {new_dataset.id}, Name: {new_dataset.name}")
+            if existing_dataset is None:
+                new_dataset = Dataset(id=dataset_id, name=dataset_name, source_path=temp_file_path)
+                db.add(new_dataset)
+                db.commit()
+                db.refresh(new_dataset)
+                task_logger.info(f"Created dataset record for ID: {new_dataset.id}, Name: {new_dataset.name}")
 
             task.progress = 50
             task.result = "Processing images..."
@@ -120,61 +207,11 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
             db.commit()
             db.refresh(task)
 
-            # Iterate through unpacked image files and create records
-            # Define allowed MIME types and extensions
-            allowed_mime_types = [
-                'image/',    # Matches any image MIME type (e.g., image/jpeg, image/png)
-                'video/',    # Matches any video MIME type (e.g., video/mp4, video/webm)
-                'text/plain' # Matches plain text files
-            ]
-            allowed_extensions = (
-                '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', # Image extensions
-                '.mp4', '.avi', '.mov', '.mkv', '.webm', # Video extensions
-                '.txt' # Text extensions
-            )
-            processed_file_count = 0
-            for root, _, files in os.walk(target_unpack_dir):
-                for f in files:
-                    full_path = os.path.join(root, f)
-                    relative_path = os.path.relpath(full_path, target_unpack_dir) # path relative to dataset root folder
-
-                    # Check if it's an allowed file based on MIME type or extension
-                    mime_type = None
-                    try:
-                        mime_type = magic.from_file(full_path, mime=True)
-                    except Exception as e:
-                        task_logger.warning(f"Could not detect MIME type for {full_path}: {e}")
-                    
-                    is_allowed_mime = any(mime_type and mime_type.startswith(t) for t in allowed_mime_types)
-                    is_allowed_extension = f.lower().endswith(allowed_extensions)
-
-                    if is_allowed_mime or is_allowed_extension:
-                        width, height = None, None
-                        # Try to get dimensions only for images
-                        if mime_type and mime_type.startswith('image/'):
-                            try:
-                                with PILImage.open(full_path) as img:
-                                    width, height = img.size
-                                # task_logger.info(f"Extracted dimensions for {f}: {width}x{height}")
-                            except Exception as e:
-                                task_logger.warning(f"Could not extract dimensions for {f} using Pillow: {e}")
-                            
-                        # Create a new record for the file
-                        new_file_record = Image( # Rename Image model to Asset or similar in future
-                            dataset_id=dataset_id,
-                            filename=f,
-                            path=os.path.basename(full_path),  # Store only the filename
-                            width=width,
-                            height=height,
-                            mime_type=mime_type # Store the detected MIME type
-                        )
-                        db.add(new_file_record)
-                        db.commit() # Commit each file record
-                        processed_file_count += 1
-                        # task_logger.info(f"Created file record for file: {f} (Path: {relative_path}, MIME: {mime_type})")
-                    else:
-                        task_logger.info(f"Skipping unsupported file: {f} (MIME: {mime_type})")
-            
+            # Probe the unpacked files and create records
+            counts = store_files(db, dataset_id, target_unpack_dir, extracted_files, known_files, timer=timer)
+            processed_file_count = counts["added"]
+            refresh_metadata_snapshot(db, dataset_id, target_unpack_dir, timer=timer)
+
             task.progress = 90
             task.result = f"Processed {processed_file_count} files. Cleaning up..."
             db.add(task)
@@ -183,7 +220,8 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
 
             task_logger.info(f"Removing temporary uploaded file: {temp_file_path}")
             try:
-                os.remove(temp_file_path)
+                with timer.stage("cleanup"):
+                    os.remove(temp_file_path)
                 task_logger.info(f"Removed temporary file: {temp_file_path}")
             except OSError as e:
                 task_logger.error(f"Error removing temporary file {temp_file_path}: {e}")
@@ -195,13 +233,14 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
 
         task.status = TaskStatus.SUCCESS.value
         task.progress = 100
-        task.result = f"Dataset '{dataset_name}' with ID {dataset_id} processed successfully."
+        timings = timer.finish()
+        task.result = f"Dataset '{dataset_name}' with ID {dataset_id} processed successfully. Timings: {json.dumps(timings)}"
         db.add(task)
         db.commit()
         db.refresh(task)
 
         task_logger.info(f"Finished 'process_dataset_upload' for dataset ID: {dataset_id}")
-        return {"status": "success", "dataset_id": str(dataset_id), "original_file": temp_file_path, "unpacked_to": target_unpack_dir}
+        return {"status": "success", "dataset_id": str(dataset_id), "original_file": temp_file_path, "unpacked_to": target_unpack_dir, "timings": timings}
     except Exception as e:
         db.rollback() # Rollback changes if any error occurs
         task_logger.error(f"An unexpected error occurred during dataset processing for {temp_file_path}: {e}", exc_info=True)
@@ -211,6 +250,352 @@ def process_dataset_upload(task_id: str, temp_file_path: str, original_filename:
         db.commit()
         return {"status": "failed", "message": f"An unexpected error occurred: {e}"}
 
+@celery_app.task(name='worker.app.worker.add_files_to_dataset', acks_late=True)
+@with_session
+def add_files_to_dataset(task_id: str, dataset_id: str, temp_file_path: str, original_filename: str, db: Session = None):
+    task_logger.info(f"Starting 'add_files_to_dataset' for task_id: {task_id}, dataset: {dataset_id}, file: {temp_file_path}")
+
+    task = db.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).first()
+    if not task:
+        task_logger.error(f"Background task with ID {task_id} not found.")
+        return {"status": "failed", "message": f"Task ID {task_id} not found."}
+
+    def fail(message):
+        task.status = TaskStatus.FAILURE.value
+        task.result = message
+        db.add(task)
+        db.commit()
+        return {"status": "failed", "message": message}
+
+    timer = StageTimer("add_files_to_dataset")
+    try:
+        task.status = TaskStatus.RUNNING.value
+        task.progress = 5
+        task.result = "Loading existing files..."
+        db.add(task)
+        db.commit()
+
+        dataset = db.query(Dataset).filter(Dataset.id == uuid.UUID(dataset_id), Dataset.deleted_at.is_(None)).first()
+        if dataset is None:
+            return fail(f"Dataset {dataset_id} not found.")
+        if not os.path.exists(temp_file_path):
+            return fail(f"File not found: {temp_file_path}")
+
+        file_extension = archive_suffix(temp_file_path)
+        if file_extension not in SUPPORTED_ARCHIVE_SUFFIXES:
+            return fail(f"Unsupported file type: {file_extension}")
+
+        dataset_dir = os.path.join(DATASETS_DIR, dataset_id)
+        known_files = load_known_files(db, dataset.id)
+
+        task.progress = 10
+        task.result = f"Unpacking archive against {len(known_files)} existing files..."
+        db.add(task)
+        db.commit()
+
+        with timer.stage("unpack"):
+            extracted_files, skipped = extract_members(iter_archive_members(temp_file_path), dataset_dir, known_files)
+        with timer.stage("insert"):
+            backfilled = backfill_known_files(db, known_files)
+        timer.count(files=len(extracted_files), size=sum(f.size for f in extracted_files))
+        task_logger.info(f"{len(extracted_files)} new or changed files, {skipped} unchanged in {original_filename}")
+
+        task.progress = 50
+        task.result = f"Processing {len(extracted_files)} new or changed files..."
+        db.add(task)
+        db.commit()
+
+        counts = store_files(db, dataset.id, dataset_dir, extracted_files, known_files, timer=timer)
+        counts["skipped"] = skipped
+        counts["backfilled"] = backfilled
+        changed_ids = [f.image_id for f in extracted_files if f.image_id is not None]
+        changed_ids += [known.image_id for known in known_files.values() if known.backfilled]
+        refresh_metadata_snapshot(db, dataset.id, dataset_dir, changed_ids, timer=timer)
+
+        with timer.stage("cleanup"):
+            try:
+                os.remove(temp_file_path)
+            except OSError as e:
+                task_logger.error(f"Error removing temporary file {temp_file_path}: {e}")
+        counts["timings"] = timer.finish()
+
+        task.status = TaskStatus.SUCCESS.value
+        task.progress = 100
+        task.result = json.dumps(counts)
+        db.add(task)
+        db.commit()
+
+        task_logger.info(f"Finished 'add_files_to_dataset' for dataset ID: {dataset_id}: {counts}")
+        return {"status": "success", "dataset_id": dataset_id, **counts}
+    except Exception as e:
+        db.rollback()
+        task_logger.error(f"An unexpected error occurred while adding files to dataset {dataset_id}: {e}", exc_info=True)
+        return fail(f"An unexpected error occurred: {e}")
+
+def record_sidecar(db: Session, dataset_id, dataset_dir: str, sidecar_path: str, known_files: dict):
+    """
+    Points the sidecar's Image row at what captioning just wrote, adding the row if the
+    dataset had no sidecar, so re-ingest compares archive members against the new file.
+    """
+    relative_path = os.path.relpath(sidecar_path, dataset_dir).replace(os.sep, "/")
+    stat = os.stat(sidecar_path)
+    values = dict(size_bytes=stat.st_size, content_hash=hash_file(sidecar_path), mtime_ns=stat.st_mtime_ns)
+    known = known_files.get(relative_path)
+    if known is not None:
+        db.query(Image).filter(Image.id == known.image_id).update(values, synchronize_session=False)
+        return known.image_id
+    image_id = uuid.uuid4()
+    db.add(Image(id=image_id, dataset_id=dataset_id, filename=os.path.basename(sidecar_path), path=relative_path, mime_type="text/plain", **values))
+    known_files[relative_path] = KnownFile(image_id=image_id, size=values["size_bytes"], content_hash=values["content_hash"])
+    return image_id
+
+def save_captions(db: Session, rows: list):
+    """
+    Adds rows to the caption cache. Another captioning task may have stored the same key
+    since this one checked the cache (e.g. the same image in two datasets); its row is kept.
+    """
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    db.execute(insert(CaptionCache).on_conflict_do_nothing(index_elements=["content_hash", "prompt_style", "model"]), rows)
+    db.commit()
+
+@celery_app.task(name='worker.app.worker.caption_dataset_images', acks_late=True)
+@with_session
+def caption_dataset_images(task_id: str, dataset_id: str, prompt_style: str = PromptStyle.SDXL.value, model: str = None, overwrite_sidecars: bool = False, db: Session = None):
+    task_logger.info(f"Starting 'caption_dataset_images' for task_id: {task_id}, dataset: {dataset_id}")
+
+    task = db.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).first()
+    if not task:
+        task_logger.error(f"Background task with ID {task_id} not found.")
+        return {"status": "failed", "message": f"Task ID {task_id} not found."}
+
+    try:
+        style = PromptStyle(prompt_style)
+        model = model or CAPTION_MODEL
+
+        dataset = db.query(Dataset).filter(Dataset.id == uuid.UUID(dataset_id), Dataset.deleted_at.is_(None)).first()
+        if dataset is None:
+            # Deleted after the request was queued; don't write sidecars into a directory being removed
+            task.status = TaskStatus.FAILURE.value
+            task.result = f"Dataset {dataset_id} not found."
+            db.add(task)
+            db.commit()
+            return {"status": "failed", "message": task.result}
+
+        task.status = TaskStatus.RUNNING.value
+        task.progress = 5
+        task.result = "Hashing images..."
+        db.add(task)
+        db.commit()
+
+        dataset_dir = os.path.join(DATASETS_DIR, dataset_id)
+        images = (
+            db.query(Image)
+            .filter(Image.dataset_id == uuid.UUID(dataset_id), Image.mime_type.like("image/%"))
+            .all()
+        )
+
+        # Key the cache on the hash recorded at ingest. Only files without one, or whose size or
+        # mtime no longer matches the row (edited outside the API), are read and hashed here.
+        hashes = {}
+        missing_files = 0
+        for image in images:
+            full_path = os.path.join(dataset_dir, image.path)
+            try:
+                stat = os.stat(full_path)
+                if image.content_hash is None or (image.size_bytes, image.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                    image.content_hash = hash_file(full_path)
+                    image.size_bytes = stat.st_size
+                    image.mtime_ns = stat.st_mtime_ns
+                    db.add(image)
+                hashes[image.id] = image.content_hash
+            except OSError as e:
+                task_logger.warning(f"Could not read {full_path} for captioning: {e}")
+                missing_files += 1
+        db.commit()
+
+        cached = {}
+        unique_hashes = list(set(hashes.values()))
+        for i in range(0, len(unique_hashes), 500): # Chunk IN clauses to stay under bind-parameter limits
+            rows = (
+                db.query(CaptionCache)
+                .filter(
+                    CaptionCache.content_hash.in_(unique_hashes[i:i + 500]),
+                    CaptionCache.prompt_style == style.value,
+                    CaptionCache.model == model,
+                )
+                .all()
+            )
+            cached.update({row.content_hash: row.caption for row in rows})
+
+        # Identical files within the dataset only need to be captioned once
+        jobs_by_hash = {}
+        for image in images:
+            content_hash = hashes.get(image.id)
+            if content_hash and content_hash not in cached and content_hash not in jobs_by_hash:
+                jobs_by_hash[content_hash] = CaptionJob(
+                    key=content_hash,
+                    path=os.path.join(dataset_dir, image.path),
+                    mime_type=image.mime_type,
+                )
+
+        task.progress = 20
+        task.result = f"Captioning {len(jobs_by_hash)} images ({len(hashes) - len(jobs_by_hash)} cached)..."
+        db.add(task)
+        db.commit()
+
+        client = CaptionClient(model=model)
+        outcomes = client.caption_all(list(jobs_by_hash.values()), style)
+
+        failed = {}
+        new_captions = []
+        for outcome in outcomes:
+            if outcome.caption is not None:
+                cached[outcome.key] = outcome.caption
+                new_captions.append(dict(content_hash=outcome.key, prompt_style=style.value, model=model, caption=outcome.caption))
+            else:
+                failed[outcome.key] = outcome.error
+                task_logger.warning(f"Captioning failed for {jobs_by_hash[outcome.key].path}: {outcome.error}")
+        save_captions(db, new_captions)
+
+        task.progress = 90
+        task.result = "Writing captions..."
+        db.add(task)
+        db.commit()
+
+        captioned_ids = []
+        captioned_count = 0
+        sidecars_kept = 0
+        known_files = load_known_files(db, dataset.id)
+        for image in images:
+            caption = cached.get(hashes.get(image.id))
+            if caption is None:
+                continue
+            image_path = os.path.join(dataset_dir, image.path)
+            existing_sidecar = read_sidecar(image_path)
+            # Sidecars shipped with the dataset, or edited since the last run, are kept unless asked otherwise
+            if existing_sidecar is not None and existing_sidecar != image.caption and not overwrite_sidecars:
+                sidecars_kept += 1
+            elif existing_sidecar != caption:
+                sidecar_path = write_sidecar(image_path, caption)
+                captioned_ids.append(record_sidecar(db, dataset.id, dataset_dir, sidecar_path, known_files))
+            image.caption = caption
+            db.add(image)
+            captioned_ids.append(image.id)
+            captioned_count += 1
+        db.commit()
+        refresh_metadata_snapshot(db, uuid.UUID(dataset_id), dataset_dir, captioned_ids)
+
+        summary = {
+            "captioned": captioned_count,
+            "backend_requests": len(jobs_by_hash),
+            "cache_hits": len(hashes) - len(jobs_by_hash),
+            "failed": len(failed) + missing_files,
+            "sidecars_kept": sidecars_kept,
+            "prompt_style": style.value,
+            "model": model,
+        }
+        task.status = TaskStatus.SUCCESS.value if not failed else TaskStatus.FAILURE.value
+        task.progress = 100
+        task.result = json.dumps(summary)
+        db.add(task)
+        db.commit()
+
+        task_logger.info(f"Finished 'caption_dataset_images' for dataset ID: {dataset_id}: {summary}")
+        return {"status": "success" if not failed else "completed_with_errors", "dataset_id": dataset_id, **summary}
+    except Exception as e:
+        db.rollback()
+        task_logger.error(f"An unexpected error occurred during captioning for dataset {dataset_id}: {e}", exc_info=True)
+        task.status = TaskStatus.FAILURE.value
+        task.result = f"An unexpected error occurred: {e}"
+        db.add(task)
+        db.commit()
+        return {"status": "failed", "message": f"An unexpected error occurred: {e}"}
+
+@celery_app.task(name='worker.app.worker.delete_dataset', acks_late=True)
+@with_session
+def delete_dataset(task_id: str, dataset_id: str, db: Session = None):
+    task_logger.info(f"Starting 'delete_dataset' for task_id: {task_id}, dataset: {dataset_id}")
+
+    task = db.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).first()
+    if not task:
+        task_logger.error(f"Background task with ID {task_id} not found.")
+        return {"status": "failed", "message": f"Task ID {task_id} not found."}
+
+    try:
+        dataset = db.query(Dataset).filter(Dataset.id == uuid.UUID(dataset_id)).first()
+        if dataset is None or dataset.deleted_at is None:
+            # Never remove data for a dataset the API hasn't marked as deleted
+            task.status = TaskStatus.FAILURE.value
+            task.result = f"Dataset {dataset_id} is not marked for deletion."
+            db.add(task)
+            db.commit()
+            return {"status": "failed", "message": task.result}
+
+        task.status = TaskStatus.RUNNING.value
+        task.progress = 5
+        task.result = "Removing files..."
+        db.add(task)
+        db.commit()
+
+        dataset_dir = os.path.join(DATASETS_DIR, dataset_id)
+        removed_files = remove_tree_parallel(dataset_dir, max_workers=DELETE_UNLINK_WORKERS)
+        task_logger.info(f"Removed {removed_files} files from {dataset_dir}")
+
+        task.progress = 50
+        task.result = f"Removed {removed_files} files. Deleting image records..."
+        db.add(task)
+        db.commit()
+
+        total_images = db.query(Image).filter(Image.dataset_id == dataset.id).count()
+        deleted_images = 0
+        while True:
+            batch_ids = select(Image.id).where(Image.dataset_id == dataset.id).limit(DELETE_BATCH_SIZE)
+            deleted = (
+                db.query(Image)
+                .filter(Image.id.in_(batch_ids))
+                .delete(synchronize_session=False)
+            )
+            if not deleted:
+                break
+            deleted_images += deleted
+            task.progress = 50 + int(40 * deleted_images / max(total_images, 1))
+            db.add(task)
+            db.commit()
+
+        db.delete(dataset)
+        task.status = TaskStatus.SUCCESS.value
+        task.progress = 100
+        task.result = f"Dataset {dataset_id} deleted ({removed_files} files, {deleted_images} image records)."
+        db.add(task)
+        db.commit()
+
+        task_logger.info(f"Finished 'delete_dataset' for dataset ID: {dataset_id}")
+        return {"status": "success", "dataset_id": dataset_id, "removed_files": removed_files, "deleted_images": deleted_images}
+    except Exception as e:
+        db.rollback()
+        task_logger.error(f"An unexpected error occurred while deleting dataset {dataset_id}: {e}", exc_info=True)
+        task.status = TaskStatus.FAILURE.value
+        task.result = f"An unexpected error occurred: {e}"
+        db.add(task)
+        db.commit()
+        return {"status": "failed", "message": f"An unexpected error occurred: {e}"}
+
+@celery_app.task(name='worker.app.worker.rebuild_dataset_snapshot', acks_late=True)
+@with_session
+def rebuild_dataset_snapshot(dataset_id: str, db: Session = None):
+    """Regenerates a dataset's metadata snapshot from scratch, e.g. for datasets ingested before snapshots existed."""
+    dataset = db.query(Dataset).filter(Dataset.id == uuid.UUID(dataset_id), Dataset.deleted_at.is_(None)).first()
+    if dataset is None:
+        return {"status": "failed", "message": f"Dataset {dataset_id} not found."}
+    rows = refresh_snapshot(db, dataset.id, os.path.join(DATASETS_DIR, dataset_id))
+    task_logger.info(f"Rebuilt metadata snapshot for dataset {dataset_id} with {rows} rows")
+    return {"status": "success", "dataset_id": dataset_id, "rows": rows}
+
 @celery_app.task
 def add(x, y):
     return x + y
\ No newline at end of file
@@ -0,0 +1 @@
+# Reproducible ingest and API benchmarks. Run with `python -m benchmarks.run --help`.
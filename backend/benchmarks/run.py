@@ -0,0 +1,295 @@
+"""
+Ingest and API benchmark.
+
+Generates a synthetic archive, runs `process_dataset_upload` in-process against
+SQLite (default) or a throwaway Postgres given by --database-url, then load-tests
+the image listing and file-serving endpoints through the ASGI app. Results are
+written as JSON so runs from different commits can be compared:
+
+    python -m benchmarks.run --files 2000 --output before.json
+    python -m benchmarks.run --files 2000 --output after.json --compare-to before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+import app.main as main
+import app.worker as worker
+from app.models import Base, BackgroundTask, Dataset, Image, build_engine
+from benchmarks.synthetic import generate_archive
+
+# Metrics where a larger value is an improvement; everything else is treated as lower-is-better
+HIGHER_IS_BETTER = ("files_per_second", "bytes_per_second", "requests_per_second")
+
+
+class RoundTripCounter:
+    """Counts statements sent to the database while enabled."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_size(value: str):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def latency_summary(latencies, wall_seconds, errors):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3) if latencies else None
+
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / wall_seconds, 1) if wall_seconds else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+async def load_test(paths, concurrency):
+    """Issues GETs for `paths` against the in-process app with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def fetch(client, path):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(path)
+            await response.aread()
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(fetch(client, path) for path in paths))
+        wall = time.perf_counter() - start
+    return latency_summary(latencies, wall, errors)
+
+
+def run_benchmark(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="loraforge-bench-")
+    saved_datasets_dirs = worker.DATASETS_DIR, main.DATASETS_DIR
+    try:
+        return _run_in(work_dir, args)
+    finally:
+        worker.DATASETS_DIR, main.DATASETS_DIR = saved_datasets_dirs
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _run_in(work_dir: str, args) -> dict:
+    datasets_dir = os.path.join(work_dir, "datasets")
+    os.makedirs(datasets_dir)
+    worker.DATASETS_DIR = datasets_dir
+    main.DATASETS_DIR = datasets_dir
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    engine = build_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    SessionFactory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    round_trips = RoundTripCounter(engine)
+
+    archive_path = os.path.join(work_dir, "upload.zip")
+    started = time.perf_counter()
+    archive = generate_archive(
+        archive_path,
+        file_count=args.files,
+        image_sizes=[parse_size(size) for size in args.image_sizes],
+        junk_ratio=args.junk_ratio,
+        seed=args.seed,
+    )
+    archive["generate_seconds"] = round(time.perf_counter() - started, 3)
+
+    db = SessionFactory()
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db.add(task)
+    db.commit()
+
+    round_trips.reset()
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    result = worker.process_dataset_upload(str(task.id), archive_path, "upload.zip", "benchmark", db=db)
+    wall = time.perf_counter() - started
+    if result.get("status") != "success":
+        raise RuntimeError(f"Ingest failed: {result}")
+
+    dataset_id = uuid.UUID(result["dataset_id"])
+    ingest = {
+        "wall_seconds": round(wall, 3),
+        "files_per_second": round(archive["files"] / wall, 1),
+        "bytes_per_second": round(archive["bytes"] / wall, 1),
+        "db_round_trips": round_trips.count,
+        "images_inserted": db.query(Image).filter(Image.dataset_id == dataset_id).count(),
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_before_mb": rss_before,
+        "stages": result["timings"]["stages"],
+    }
+
+    # Every request gets its own session, like the real get_db dependency
+    def override_get_db():
+        session = SessionFactory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    main.app.dependency_overrides[main.get_db] = override_get_db
+    image_ids = [str(image_id) for (image_id,) in db.query(Image.id).filter(Image.dataset_id == dataset_id)]
+    rng = random.Random(args.seed)
+    endpoints = {}
+    try:
+        round_trips.reset()
+        endpoints["list_images"] = asyncio.run(
+            load_test([f"/v1/datasets/{dataset_id}/images/"] * args.list_requests, args.concurrency)
+        )
+        endpoints["list_images"]["db_round_trips"] = round_trips.count
+
+        round_trips.reset()
+        file_paths = [f"/v1/images/{rng.choice(image_ids)}/file" for _ in range(args.file_requests)] if image_ids else []
+        endpoints["image_file"] = asyncio.run(load_test(file_paths, args.concurrency))
+        endpoints["image_file"]["db_round_trips"] = round_trips.count
+    finally:
+        main.app.dependency_overrides.pop(main.get_db, None)
+
+    # Leave a shared Postgres as we found it; the SQLite file and dataset files go with the work dir
+    db.query(Image).filter(Image.dataset_id == dataset_id).delete(synchronize_session=False)
+    db.query(Dataset).filter(Dataset.id == dataset_id).delete(synchronize_session=False)
+    db.delete(task)
+    db.commit()
+    db.close()
+    engine.dispose()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "database": engine.dialect.name,
+        "params": {
+            "files": args.files,
+            "image_sizes": args.image_sizes,
+            "junk_ratio": args.junk_ratio,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "list_requests": args.list_requests,
+            "file_requests": args.file_requests,
+        },
+        "archive": archive,
+        "ingest": ingest,
+        "endpoints": endpoints,
+    }
+
+
+def flatten(results: dict, prefix="") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, max_regression: float):
+    """Returns (rows, regressions) comparing timing/throughput metrics between two result files."""
+    keys = [
+        key for key in flatten(current)
+        if key.startswith(("ingest.", "endpoints.")) and not key.endswith(("requests", "errors", "images_inserted"))
+    ]
+    old, new = flatten(baseline), flatten(current)
+    rows, regressions = [], []
+    for key in keys:
+        if key not in old or not old[key]:
+            continue
+        change = (new[key] - old[key]) / old[key]
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        rows.append((key, old[key], new[key], change))
+        if worse > max_regression:
+            regressions.append(key)
+    return rows, regressions
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=1000, help="Entries in the synthetic archive")
+    parser.add_argument("--image-sizes", nargs="+", default=["512x512", "1024x1024"], help="WIDTHxHEIGHT values to draw from")
+    parser.add_argument("--junk-ratio", type=float, default=0.05, help="Share of non-media entries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", help="Throwaway database to use instead of a temporary SQLite file")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests during the load test")
+    parser.add_argument("--list-requests", type=int, default=50)
+    parser.add_argument("--file-requests", type=int, default=500)
+    parser.add_argument("--output", help="Write JSON results here (default: stdout)")
+    parser.add_argument("--compare-to", help="Baseline JSON from a previous run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args)
+    payload = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+    if args.compare_to:
+        with open(args.compare_to) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, results, args.max_regression)
+        for key, old, new, change in rows:
+            marker = "  REGRESSION" if key in regressions else ""
+            print(f"{key:45} {old:>14.3f} {new:>14.3f} {change:+8.1%}{marker}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,58 @@
+import io
+import os
+import random
+import zipfile
+from typing import List, Tuple
+
+from PIL import Image as PILImage
+
+JUNK_EXTENSIONS = (".bin", ".dat", ".DS_Store", ".db")
+
+
+def render_image(rng: random.Random, size: Tuple[int, int], fmt: str) -> bytes:
+    """A small gradient with a random tint, so files differ without paying for random noise."""
+    width, height = size
+    tint = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    img = PILImage.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = PILImage.blend(img, PILImage.new("RGB", (width, height), tint), 0.5)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def generate_archive(
+    path: str,
+    file_count: int,
+    image_sizes: List[Tuple[int, int]],
+    junk_ratio: float = 0.0,
+    dirs: int = 4,
+    seed: int = 0,
+) -> dict:
+    """
+    Writes a ZIP of `file_count` entries spread over `dirs` folders. A `junk_ratio` share
+    are random bytes with non-media extensions; the rest are JPEG/PNG images whose size is
+    drawn from `image_sizes`. The same arguments always produce the same archive.
+    """
+    rng = random.Random(seed)
+    # Encoding is the slow part of generation; reuse a pool of rendered images
+    variants = [
+        (render_image(rng, size, fmt), ext)
+        for size in image_sizes
+        for fmt, ext in (("JPEG", ".jpg"), ("PNG", ".png"))
+        for _ in range(4)
+    ]
+    images = junk = total_bytes = 0
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for i in range(file_count):
+            folder = f"set_{i % dirs:02d}" if dirs else ""
+            if rng.random() < junk_ratio:
+                content = os.urandom(rng.randrange(64, 4096))
+                name = f"junk_{i:06d}{rng.choice(JUNK_EXTENSIONS)}"
+                junk += 1
+            else:
+                content, ext = rng.choice(variants)
+                name = f"img_{i:06d}{ext}"
+                images += 1
+            archive.writestr(f"{folder}/{name}" if folder else name, content)
+            total_bytes += len(content)
+    return {"files": file_count, "images": images, "junk": junk, "bytes": total_bytes, "archive_bytes": os.path.getsize(path)}
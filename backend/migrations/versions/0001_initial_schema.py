@@ -0,0 +1,57 @@
+"""Initial schema, exactly as the old per-startup Base.metadata.create_all created it
+
+Databases that were bootstrapped by the old per-startup create_all already
+have these tables; mark them with `alembic stamp 0001` before upgrading.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "datasets",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("source_path", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "images",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("dataset_id", sa.UUID(), nullable=False),
+        sa.Column("filename", sa.String(), nullable=False),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("width", sa.Integer()),
+        sa.Column("height", sa.Integer()),
+        sa.Column("mime_type", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["dataset_id"], ["datasets.id"], name="images_dataset_id_fkey"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "background_tasks",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("task_name", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("progress", sa.Integer(), nullable=False),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    op.drop_table("background_tasks")
+    op.drop_table("images")
+    op.drop_table("datasets")
@@ -0,0 +1,35 @@
+"""Add images.caption and the caption_cache table for batch captioning
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("images", sa.Column("caption", sa.Text(), nullable=True))
+    op.create_table(
+        "caption_cache",
+        sa.Column("id", sa.UUID(), nullable=False),
+        sa.Column("content_hash", sa.String(length=64), nullable=False),
+        sa.Column("prompt_style", sa.String(), nullable=False),
+        sa.Column("model", sa.String(), nullable=False),
+        sa.Column("caption", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("content_hash", "prompt_style", "model", name="uq_caption_cache_key"),
+    )
+
+
+def downgrade():
+    op.drop_table("caption_cache")
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_column("caption")
@@ -0,0 +1,39 @@
+"""Indexes for hot query paths and ON DELETE CASCADE for images.dataset_id
+
+- ix_images_dataset_id_width_height: GET /v1/datasets/{id}/images/ filters on
+  dataset_id; width/height trail so dimension filters within a dataset stay
+  index-only. It also backs the cascade below, which would otherwise scan
+  the whole images table per deleted dataset.
+- ix_background_tasks_status_created_at: task listings by status, newest first.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_images_dataset_id_width_height", "images", ["dataset_id", "width", "height"])
+    op.create_index("ix_background_tasks_status_created_at", "background_tasks", ["status", "created_at"])
+
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_constraint("images_dataset_id_fkey", type_="foreignkey")
+        batch_op.create_foreign_key(
+            "images_dataset_id_fkey", "datasets", ["dataset_id"], ["id"], ondelete="CASCADE"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_constraint("images_dataset_id_fkey", type_="foreignkey")
+        batch_op.create_foreign_key("images_dataset_id_fkey", "datasets", ["dataset_id"], ["id"])
+
+    op.drop_index("ix_background_tasks_status_created_at", table_name="background_tasks")
+    op.drop_index("ix_images_dataset_id_width_height", table_name="images")
@@ -0,0 +1,23 @@
+"""Add datasets.deleted_at so deletion can be acknowledged before files and rows are removed
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("datasets", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("datasets") as batch_op:
+        batch_op.drop_column("deleted_at")
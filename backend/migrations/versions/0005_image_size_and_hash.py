@@ -0,0 +1,128 @@
+"""Record file size and content hash on images for incremental re-ingest
+
+Also makes (dataset_id, path) unique, since re-ingest matches archive members to
+rows by path. Datasets ingested before paths kept their folders store only the
+file name, so nested files can't be matched and several rows may share one path.
+Those paths are rebuilt from the files in the dataset directory (DATASETS_DIR,
+default /data/datasets) first. Rows sharing a name are paired with the matching
+files in path order and re-probed, since their dimensions may belong to another
+file. Only rows that no file on disk accounts for are removed, and only as many
+as the unique index needs. When a dataset directory is not present, all but one
+row per duplicate path are removed instead; the files come back on the next
+re-ingest.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19
+"""
+import logging
+import os
+import uuid
+from collections import defaultdict
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# Rows per DELETE when removing duplicate paths
+DEDUPE_BATCH_SIZE = 500
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def files_by_name(dataset_dir):
+    """Maps each file name to its '/'-separated paths under `dataset_dir`, top-level first."""
+    found = defaultdict(list)
+    for root, _, files in os.walk(dataset_dir):
+        for name in files:
+            relative_path = os.path.relpath(os.path.join(root, name), dataset_dir).replace(os.sep, "/")
+            found[name].append(relative_path)
+    for paths in found.values():
+        paths.sort(key=lambda path: (path.count("/"), path))
+    return found
+
+
+def rebuild_paths(connection, images, dataset_id, dataset_dir):
+    """Rewrites legacy bare-name paths to the files' real relative paths; returns ids of rows to remove."""
+    from app.ingest import probe_file
+
+    rows = connection.execute(
+        sa.select(images.c.id, images.c.path).where(images.c.dataset_id == dataset_id).order_by(images.c.id)
+    ).all()
+    claimed = {path for _, path in rows if "/" in path} # Already full relative paths
+    legacy = defaultdict(list)
+    for image_id, path in rows:
+        if "/" not in path:
+            legacy[path].append(image_id)
+
+    on_disk = files_by_name(dataset_dir)
+    extra_ids = []
+    for name, image_ids in legacy.items():
+        candidates = [path for path in on_disk.get(name, []) if path not in claimed]
+        for image_id, path in zip(image_ids, candidates):
+            values = {"path": path}
+            if len(image_ids) > 1:
+                # Rows sharing a name are indistinguishable; take dimensions from the file each now points at
+                allowed, mime_type, width, height = probe_file(os.path.join(dataset_dir, path))
+                if allowed:
+                    values.update(mime_type=mime_type, width=width, height=height)
+            connection.execute(images.update().where(images.c.id == image_id).values(**values))
+        unmatched = image_ids[len(candidates):]
+        if unmatched and name not in candidates[:len(image_ids)]:
+            unmatched = unmatched[1:] # One row may keep the bare name
+        extra_ids.extend(unmatched)
+    return extra_ids
+
+
+def duplicate_ids(connection, images, dataset_id):
+    """Ids of all but one row per duplicated path in the dataset."""
+    rows = connection.execute(
+        sa.select(images.c.id, images.c.path).where(images.c.dataset_id == dataset_id).order_by(images.c.path, images.c.id)
+    ).all()
+    seen, extra_ids = set(), []
+    for image_id, path in rows:
+        if path in seen:
+            extra_ids.append(image_id)
+        seen.add(path)
+    return extra_ids
+
+
+def upgrade():
+    op.add_column("images", sa.Column("size_bytes", sa.BigInteger(), nullable=True))
+    op.add_column("images", sa.Column("content_hash", sa.String(length=64), nullable=True))
+
+    connection = op.get_bind()
+    datasets_dir = os.environ.get("DATASETS_DIR", "/data/datasets")
+    images = sa.table(
+        "images", sa.column("id"), sa.column("dataset_id"), sa.column("path"),
+        sa.column("mime_type"), sa.column("width"), sa.column("height"),
+    )
+    legacy_dataset_ids = connection.execute(
+        sa.select(images.c.dataset_id).where(sa.not_(images.c.path.contains("/"))).distinct()
+    ).scalars().all()
+
+    extra_ids = []
+    for dataset_id in legacy_dataset_ids:
+        # SQLite hands back the stored hex; dataset directories use the dashed form
+        dataset_dir = os.path.join(datasets_dir, str(uuid.UUID(str(dataset_id))))
+        if os.path.isdir(dataset_dir):
+            extra_ids.extend(rebuild_paths(connection, images, dataset_id, dataset_dir))
+        else:
+            logger.warning(f"No directory for dataset {dataset_id} at {dataset_dir}; removing duplicate image paths instead of rebuilding them")
+            extra_ids.extend(duplicate_ids(connection, images, dataset_id))
+    for i in range(0, len(extra_ids), DEDUPE_BATCH_SIZE):
+        connection.execute(images.delete().where(images.c.id.in_(extra_ids[i:i + DEDUPE_BATCH_SIZE])))
+
+    op.create_index("uq_images_dataset_id_path", "images", ["dataset_id", "path"], unique=True)
+
+
+def downgrade():
+    op.drop_index("uq_images_dataset_id_path", table_name="images")
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_column("content_hash")
+        batch_op.drop_column("size_bytes")
@@ -0,0 +1,23 @@
+"""Add images.mtime_ns so captioning can tell files edited outside the API from unchanged ones
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("images", sa.Column("mtime_ns", sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("images") as batch_op:
+        batch_op.drop_column("mtime_ns")
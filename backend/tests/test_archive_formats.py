@@ -0,0 +1,139 @@
+import gzip
+import io
+import shutil
+import tarfile
+
+import pytest
+
+import app.archives as archives
+import app.worker as worker
+from app.archives import PrefetchReader, UnsupportedArchiveError, iter_archive_members
+from app.ingest import extract_members
+from app.models import BackgroundTask, Image
+from app.storage import archive_suffix
+from app.worker import process_dataset_upload
+from conftest import png_bytes
+
+
+FILES = {
+    "a.png": png_bytes("red"),
+    "nested/b.png": png_bytes("blue", (5, 7)),
+    "nested/b.txt": b"a blue square",
+}
+
+
+def write_tar(path, files, symlinks=()):
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in symlinks:
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+    data = raw.getvalue()
+
+    suffix = archive_suffix(str(path))
+    if suffix in (".tar.gz", ".tgz"):
+        data = gzip.compress(data)
+    elif suffix in (".tar.zst", ".tzst"):
+        zstandard = pytest.importorskip("zstandard")
+        data = zstandard.ZstdCompressor().compress(data)
+    path.write_bytes(data)
+    return str(path)
+
+
+def read_members(archive_path):
+    return {member.name: member.stream.read() for member in iter_archive_members(archive_path)}
+
+
+def test_archive_suffix():
+    assert archive_suffix("/tmp/upload.TAR.GZ") == ".tar.gz"
+    assert archive_suffix("photos.v2.tar.zst") == ".tar.zst"
+    assert archive_suffix("photos.tgz") == ".tgz"
+    assert archive_suffix("photos.zip") == ".zip"
+    assert archive_suffix("photos.gz") == ".gz"
+
+
+@pytest.mark.parametrize("name", ["upload.tar", "upload.tar.gz", "upload.tgz", "upload.tar.zst"])
+def test_ingests_tar_archives(db_session, tmp_path, monkeypatch, name):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    archive = write_tar(tmp_path / name, FILES)
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+
+    result = process_dataset_upload(str(task.id), archive, name, "Tarball", db=db_session)
+    assert result["status"] == "success"
+    assert result["timings"]["files"] == 3
+
+    images = {image.path: image for image in db_session.query(Image).all()}
+    assert set(images) == set(FILES)
+    assert (images["nested/b.png"].width, images["nested/b.png"].height) == (5, 7)
+    dataset_dir = tmp_path / "datasets" / result["dataset_id"]
+    assert (dataset_dir / "nested" / "b.txt").read_bytes() == b"a blue square"
+
+
+def test_tar_skips_links_and_unsafe_paths(tmp_path):
+    files = dict(FILES, **{"../escape.png": b"nope"})
+    archive = write_tar(tmp_path / "upload.tar", files, symlinks=[("link.png", "/etc/passwd")])
+    assert set(read_members(archive)) == set(FILES) | {"../escape.png"}
+
+    dataset_dir = tmp_path / "dataset"
+    extracted, _ = extract_members(iter_archive_members(archive), str(dataset_dir))
+    assert {f.relative_path for f in extracted} == set(FILES)
+    assert not (tmp_path / "escape.png").exists()
+    assert not (dataset_dir / "link.png").exists()
+
+
+def test_gzip_decodes_through_external_decompressor(tmp_path, monkeypatch):
+    # Stand in for pigz with gzip, which takes the same -dc flags
+    gzip_binary = shutil.which("gzip")
+    if gzip_binary is None:
+        pytest.skip("gzip is not installed")
+    monkeypatch.setattr(archives.shutil, "which", lambda name: gzip_binary if name == "pigz" else None)
+    archive = write_tar(tmp_path / "upload.tar.gz", FILES)
+    assert read_members(archive) == FILES
+
+
+def test_external_decompressor_failure_is_raised(tmp_path, monkeypatch):
+    gzip_binary = shutil.which("gzip")
+    if gzip_binary is None:
+        pytest.skip("gzip is not installed")
+    monkeypatch.setattr(archives.shutil, "which", lambda name: gzip_binary if name == "pigz" else None)
+    archive = tmp_path / "upload.tar.gz"
+    archive.write_bytes(gzip.compress(b"x" * 4096)[:-8]) # Truncated trailer
+    with pytest.raises((OSError, tarfile.TarError)):
+        read_members(str(archive))
+
+
+def test_unsupported_suffix_is_rejected(tmp_path):
+    with pytest.raises(UnsupportedArchiveError):
+        iter_archive_members(str(tmp_path / "upload.7z"))
+
+
+def test_prefetch_reader_reraises_decoder_errors():
+    chunks = iter([b"abc", b"def"])
+
+    def read_chunk():
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("corrupt stream")
+        return chunk
+
+    reader = io.BufferedReader(PrefetchReader(read_chunk, depth=1))
+    assert reader.read(6) == b"abcdef"
+    with pytest.raises(ValueError, match="corrupt stream"):
+        reader.read()
+    reader.close()
+
+
+def test_prefetch_reader_close_stops_producer():
+    reader = PrefetchReader(lambda: b"x" * 1024, depth=2)
+    assert reader.read(10) == b"x" * 10
+    reader.close()
+    assert reader.closed
+    assert not reader._thread.is_alive()
@@ -0,0 +1,42 @@
+import json
+import os
+import tempfile
+
+import app.main as main
+import app.worker as worker
+from benchmarks.run import compare, main_cli
+
+
+def test_benchmark_smoke(tmp_path, monkeypatch):
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(scratch))
+    datasets_dirs = worker.DATASETS_DIR, main.DATASETS_DIR
+    output = tmp_path / "results.json"
+
+    exit_code = main_cli([
+        "--files", "20", "--image-sizes", "32x32", "--junk-ratio", "0.25",
+        "--list-requests", "3", "--file-requests", "10", "--output", str(output),
+    ])
+    assert exit_code == 0
+    # The work dir is removed and the globals the harness repointed are restored
+    assert os.listdir(scratch) == []
+    assert (worker.DATASETS_DIR, main.DATASETS_DIR) == datasets_dirs
+
+    results = json.loads(output.read_text())
+    assert results["archive"]["files"] == 20
+    assert results["ingest"]["images_inserted"] == results["archive"]["images"]
+    assert results["ingest"]["db_round_trips"] > 0
+    assert set(results["ingest"]["stages"]) == {"unpack", "probe", "insert", "snapshot", "cleanup"}
+    assert results["endpoints"]["list_images"]["errors"] == 0
+    assert results["endpoints"]["image_file"]["requests"] == 10
+    assert results["endpoints"]["image_file"]["errors"] == 0
+
+
+def test_compare_flags_regressions_in_the_right_direction():
+    baseline = {"ingest": {"wall_seconds": 10.0, "files_per_second": 100.0}}
+    current = {"ingest": {"wall_seconds": 9.0, "files_per_second": 70.0}}
+
+    rows, regressions = compare(baseline, current, max_regression=0.2)
+    assert len(rows) == 2
+    assert regressions == ["ingest.files_per_second"]
@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import app.worker as worker
+from app.captioning import CaptionClient, CaptionJob
+from app.models import Dataset, Image, BackgroundTask, CaptionCache, PromptStyle, TaskStatus
+from app.storage import hash_file
+from app.worker import add_files_to_dataset, caption_dataset_images, process_dataset_upload
+from conftest import png_bytes, write_zip
+
+
+class StubCaptionHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat completions stub that echoes a caption derived from the prompt."""
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            fail = server.failures_remaining > 0
+            if fail:
+                server.failures_remaining -= 1
+        try:
+            time.sleep(server.delay)
+            self.respond(body, fail)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def respond(self, body, fail):
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+        prompt = body["messages"][0]["content"][0]["text"]
+        caption = f"{body['model']} caption: {'tags' if 'tags' in prompt else 'prose'}"
+        payload = json.dumps({"choices": [{"message": {"role": "assistant", "content": caption}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(name="stub_server")
+def stub_server_fixture():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCaptionHandler)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures_remaining = 0
+    server.in_flight = 0
+    server.peak_in_flight = 0
+    server.delay = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def use_stub_server(monkeypatch, stub_server):
+    url = f"http://127.0.0.1:{stub_server.server_address[1]}/v1/chat/completions"
+    monkeypatch.setattr(worker, "CaptionClient", lambda model: CaptionClient(base_url=url, model=model, backoff_base=0.01))
+
+
+@pytest.fixture(name="dataset")
+def dataset_fixture(db_session, tmp_path, monkeypatch, stub_server):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path))
+    use_stub_server(monkeypatch, stub_server)
+
+    dataset = Dataset(id=uuid.uuid4(), name="Captions", source_path="test.zip")
+    db_session.add(dataset)
+    dataset_dir = tmp_path / str(dataset.id)
+    dataset_dir.mkdir()
+    for i in range(3):
+        (dataset_dir / f"img{i}.png").write_bytes(f"fake png {i}".encode())
+        db_session.add(Image(dataset_id=dataset.id, filename=f"img{i}.png", path=f"img{i}.png", mime_type="image/png"))
+    db_session.commit()
+    return dataset, dataset_dir
+
+
+def run_captioning(db_session, dataset_id, prompt_style=PromptStyle.SDXL.value, model="stub-model", overwrite_sidecars=False):
+    task = BackgroundTask(task_name="caption_dataset_images")
+    db_session.add(task)
+    db_session.commit()
+    result = caption_dataset_images(str(task.id), str(dataset_id), prompt_style, model, overwrite_sidecars, db=db_session)
+    db_session.refresh(task)
+    return task, result
+
+
+def test_captions_are_written_and_cached(db_session, dataset, stub_server):
+    dataset, dataset_dir = dataset
+
+    task, result = run_captioning(db_session, dataset.id)
+    assert result["status"] == "success"
+    assert task.status == TaskStatus.SUCCESS.value
+    assert json.loads(task.result)["backend_requests"] == 3
+    assert stub_server.requests == 3
+    assert (dataset_dir / "img0.txt").read_text() == "stub-model caption: tags"
+    assert all(image.caption == "stub-model caption: tags" for image in db_session.query(Image).filter(Image.mime_type == "image/png"))
+    assert db_session.query(CaptionCache).count() == 3
+
+    # Unchanged images are served entirely from the cache
+    _, result = run_captioning(db_session, dataset.id)
+    assert result["cache_hits"] == 3
+    assert stub_server.requests == 3
+
+    # Only the modified image goes back to the backend
+    (dataset_dir / "img1.png").write_bytes(b"edited")
+    _, result = run_captioning(db_session, dataset.id)
+    assert result["backend_requests"] == 1
+    assert stub_server.requests == 4
+
+    # An edit that keeps the byte size is caught by the mtime
+    image_path = dataset_dir / "img2.png"
+    mtime_ns = image_path.stat().st_mtime_ns
+    image_path.write_bytes(b"fake png 9")
+    os.utime(image_path, ns=(mtime_ns + 1_000_000, mtime_ns + 1_000_000))
+    _, result = run_captioning(db_session, dataset.id)
+    assert result["backend_requests"] == 1
+    assert stub_server.requests == 5
+
+    # A different prompt style is a different cache key
+    _, result = run_captioning(db_session, dataset.id, prompt_style=PromptStyle.FLUX.value)
+    assert result["backend_requests"] == 3
+    assert (dataset_dir / "img2.txt").read_text() == "stub-model caption: prose"
+
+
+def test_concurrent_task_caching_the_same_image_is_tolerated(db_session, dataset, monkeypatch):
+    dataset, dataset_dir = dataset
+    make_client = worker.CaptionClient
+
+    def racing_client(model):
+        client = make_client(model)
+        caption_all = client.caption_all
+
+        def caption_all_after_other_task(jobs, style):
+            outcomes = caption_all(jobs, style)
+            # Another task captioned the same file in the meantime and stored it first
+            other = sessionmaker(bind=db_session.get_bind())()
+            other.add(CaptionCache(content_hash=jobs[0].key, prompt_style=style.value, model=model, caption="theirs"))
+            other.commit()
+            other.close()
+            return outcomes
+
+        client.caption_all = caption_all_after_other_task
+        return client
+
+    monkeypatch.setattr(worker, "CaptionClient", racing_client)
+    task, result = run_captioning(db_session, dataset.id)
+    assert result["status"] == "success"
+    assert result["captioned"] == 3
+    assert task.status == TaskStatus.SUCCESS.value
+    assert (dataset_dir / "img0.txt").exists()
+    assert db_session.query(CaptionCache).count() == 3
+    assert db_session.query(CaptionCache).filter(CaptionCache.caption == "theirs").count() == 1
+
+
+def test_existing_sidecars_are_kept_unless_overwritten(db_session, tmp_path, monkeypatch, stub_server):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    use_stub_server(monkeypatch, stub_server)
+    files = {"a.png": png_bytes("red"), "a.txt": b"hand written", "b.png": png_bytes("blue")}
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+    dataset_id = process_dataset_upload(str(task.id), write_zip(tmp_path / "upload.zip", files), "upload.zip", "Sidecars", db=db_session)["dataset_id"]
+    dataset_dir = tmp_path / "datasets" / dataset_id
+
+    def sidecar_rows():
+        rows = db_session.query(Image).filter(Image.mime_type == "text/plain").all()
+        for row in rows:
+            db_session.refresh(row)
+        return {row.path: row for row in rows}
+
+    _, result = run_captioning(db_session, dataset_id)
+    assert (result["captioned"], result["sidecars_kept"]) == (2, 1)
+    assert (dataset_dir / "a.txt").read_bytes() == b"hand written"
+    assert (dataset_dir / "b.txt").read_text() == "stub-model caption: tags"
+    # The generated sidecar gets a row describing the file on disk
+    assert sidecar_rows()["b.txt"].content_hash == hash_file(str(dataset_dir / "b.txt"))
+
+    # Re-ingesting the original archive leaves both sidecars alone
+    task = BackgroundTask(task_name="add_files_to_dataset")
+    db_session.add(task)
+    db_session.commit()
+    result = add_files_to_dataset(str(task.id), dataset_id, write_zip(tmp_path / "again.zip", files), "again.zip", db=db_session)
+    assert (result["added"], result["updated"]) == (0, 0)
+    assert (dataset_dir / "a.txt").read_bytes() == b"hand written"
+    assert (dataset_dir / "b.txt").read_text() == "stub-model caption: tags"
+
+    _, result = run_captioning(db_session, dataset_id, overwrite_sidecars=True)
+    assert result["sidecars_kept"] == 0
+    assert (dataset_dir / "a.txt").read_text() == "stub-model caption: tags"
+    rows = sidecar_rows()
+    assert rows["a.txt"].content_hash == hash_file(str(dataset_dir / "a.txt"))
+    assert rows["a.txt"].size_bytes == len("stub-model caption: tags")
+
+
+def test_transient_backend_errors_are_retried(db_session, dataset, stub_server):
+    dataset, _ = dataset
+    stub_server.failures_remaining = 2
+
+    task, result = run_captioning(db_session, dataset.id)
+    assert result["status"] == "success"
+    assert result["captioned"] == 3
+    assert stub_server.requests == 5
+
+
+def test_client_caps_requests_in_flight(tmp_path, stub_server):
+    stub_server.delay = 0.05
+    jobs = []
+    for i in range(8):
+        path = tmp_path / f"img{i}.png"
+        path.write_bytes(f"fake png {i}".encode())
+        jobs.append(CaptionJob(key=str(i), path=str(path), mime_type="image/png"))
+    url = f"http://127.0.0.1:{stub_server.server_address[1]}/v1/chat/completions"
+
+    outcomes = CaptionClient(base_url=url, model="stub-model", concurrency=2).caption_all(jobs, PromptStyle.SDXL)
+    assert [outcome.key for outcome in outcomes] == [job.key for job in jobs]
+    assert all(outcome.caption == "stub-model caption: tags" for outcome in outcomes)
+    assert stub_server.requests == 8
+    assert stub_server.peak_in_flight == 2
+
+
+def test_stored_content_hashes_are_not_recomputed(db_session, dataset, monkeypatch):
+    dataset, dataset_dir = dataset
+    run_captioning(db_session, dataset.id)
+    # Hashes computed on the first run are kept on the rows for later runs
+    images = db_session.query(Image).all()
+    assert all(image.content_hash == hash_file(str(dataset_dir / image.path)) for image in images)
+
+    hashed = []
+    monkeypatch.setattr(worker, "hash_file", lambda path: hashed.append(path) or hash_file(path))
+    _, result = run_captioning(db_session, dataset.id)
+    assert result["cache_hits"] == 3
+    assert hashed == []
@@ -0,0 +1,176 @@
+import os
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+import app.worker as worker
+from app.main import app, get_db
+from app.models import Dataset, Image, BackgroundTask, TaskStatus
+import app.storage as storage
+from app.storage import remove_tree_parallel
+from app.worker import caption_dataset_images, delete_dataset
+
+
+@pytest.fixture(name="client")
+def client_fixture(db_session, monkeypatch):
+    sent_tasks = []
+    monkeypatch.setattr(
+        main.celery_app, "send_task",
+        lambda name, args: sent_tasks.append((name, args)) or SimpleNamespace(id=str(uuid.uuid4())),
+    )
+    app.dependency_overrides[get_db] = lambda: db_session
+    client = TestClient(app)
+    client.sent_tasks = sent_tasks
+    yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(name="dataset")
+def dataset_fixture(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path))
+    monkeypatch.setattr(worker, "DELETE_BATCH_SIZE", 3)
+
+    dataset = Dataset(id=uuid.uuid4(), name="Doomed", source_path="doomed.zip")
+    db_session.add(dataset)
+    dataset_dir = tmp_path / str(dataset.id)
+    (dataset_dir / "nested" / "deeper").mkdir(parents=True)
+    for i in range(10):
+        subdir = [dataset_dir, dataset_dir / "nested", dataset_dir / "nested" / "deeper"][i % 3]
+        (subdir / f"img{i}.png").write_bytes(b"png")
+        db_session.add(Image(dataset_id=dataset.id, filename=f"img{i}.png", path=f"img{i}.png", mime_type="image/png"))
+    db_session.commit()
+    return dataset, dataset_dir
+
+
+def test_delete_hides_dataset_then_worker_removes_everything(client, db_session, dataset, monkeypatch):
+    dataset, dataset_dir = dataset
+
+    response = client.delete(f"/v1/datasets/{dataset.id}")
+    assert response.status_code == 202
+    task_id = response.json()["id"]
+    assert client.sent_tasks == [("worker.app.worker.delete_dataset", [task_id, str(dataset.id)])]
+
+    # Hidden immediately, before the worker has run
+    assert client.get("/v1/datasets/").json() == []
+    assert client.get(f"/v1/datasets/{dataset.id}/images/").status_code == 404
+
+    # Record the task's progress at every commit to see each delete batch
+    task = db_session.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).first()
+    progress = []
+    commit = db_session.commit
+    monkeypatch.setattr(db_session, "commit", lambda: progress.append(task.progress) or commit())
+
+    result = delete_dataset(task_id, str(dataset.id), db=db_session)
+    assert result["status"] == "success"
+    assert result["removed_files"] == 10
+    assert result["deleted_images"] == 10
+    assert not dataset_dir.exists()
+    assert db_session.query(Image).count() == 0
+    assert db_session.query(Dataset).count() == 0
+
+    db_session.refresh(task)
+    assert task.status == TaskStatus.SUCCESS.value
+    assert task.progress == 100
+    # 10 rows in batches of 3: four batches, the last one partial
+    assert progress == [5, 50, 62, 74, 86, 90, 100]
+
+
+def test_failed_deletion_can_be_retried(client, db_session, dataset, monkeypatch):
+    dataset, dataset_dir = dataset
+    first_task = client.delete(f"/v1/datasets/{dataset.id}").json()["id"]
+
+    def busy_directory(*args, **kwargs):
+        raise OSError(39, "Directory not empty")
+
+    with monkeypatch.context() as m:
+        m.setattr(worker, "remove_tree_parallel", busy_directory)
+        assert delete_dataset(first_task, str(dataset.id), db=db_session)["status"] == "failed"
+    assert dataset_dir.exists()
+
+    # Still hidden, but DELETE queues a fresh task instead of returning 404
+    assert client.get("/v1/datasets/").json() == []
+    response = client.delete(f"/v1/datasets/{dataset.id}")
+    assert response.status_code == 202
+    retry_task = response.json()["id"]
+    assert retry_task != first_task
+    assert client.sent_tasks[-1] == ("worker.app.worker.delete_dataset", [retry_task, str(dataset.id)])
+
+    assert delete_dataset(retry_task, str(dataset.id), db=db_session)["status"] == "success"
+    assert not dataset_dir.exists()
+    assert client.delete(f"/v1/datasets/{dataset.id}").status_code == 404
+
+
+def test_delete_reports_unpublished_task(client, db_session, dataset, monkeypatch):
+    dataset, _ = dataset
+
+    def broker_down(name, args):
+        raise ConnectionError("broker unavailable")
+
+    monkeypatch.setattr(main.celery_app, "send_task", broker_down)
+    assert client.delete(f"/v1/datasets/{dataset.id}").status_code == 503
+    task = db_session.query(BackgroundTask).filter(BackgroundTask.task_name == "delete_dataset").one()
+    assert task.status == TaskStatus.FAILURE.value
+
+    monkeypatch.setattr(main.celery_app, "send_task", lambda name, args: SimpleNamespace(id=str(uuid.uuid4())))
+    assert client.delete(f"/v1/datasets/{dataset.id}").status_code == 202
+
+
+def test_captioning_skips_deleted_dataset(db_session, dataset):
+    dataset, dataset_dir = dataset
+    dataset.deleted_at = datetime.utcnow()
+    task = BackgroundTask(task_name="caption_dataset_images")
+    db_session.add_all([dataset, task])
+    db_session.commit()
+
+    result = caption_dataset_images(str(task.id), str(dataset.id), db=db_session)
+    assert result["status"] == "failed"
+    assert not list(dataset_dir.rglob("*.txt"))
+
+
+def test_worker_refuses_dataset_not_marked_deleted(db_session, dataset):
+    dataset, dataset_dir = dataset
+    task = BackgroundTask(task_name="delete_dataset")
+    db_session.add(task)
+    db_session.commit()
+
+    result = delete_dataset(str(task.id), str(dataset.id), db=db_session)
+    assert result["status"] == "failed"
+    assert dataset_dir.exists()
+    assert db_session.query(Image).count() == 10
+
+
+def test_remove_tree_parallel(tmp_path):
+    root = tmp_path / "tree"
+    for d in range(5):
+        (root / f"d{d}" / "sub").mkdir(parents=True)
+        for f in range(300):
+            (root / f"d{d}" / "sub" / f"{f}.bin").write_bytes(b"")
+    os.symlink(tmp_path, root / "link_to_parent") # Must be unlinked, not followed
+
+    assert remove_tree_parallel(str(root), max_workers=4) == 1501
+    assert not root.exists()
+    assert tmp_path.exists()
+    assert remove_tree_parallel(str(root)) == 0
+
+
+def test_remove_tree_parallel_rescans_when_files_appear(tmp_path, monkeypatch):
+    root = tmp_path / "tree"
+    (root / "sub").mkdir(parents=True)
+    (root / "sub" / "a.png").write_bytes(b"")
+    original = storage._unlink_all
+    calls = []
+
+    def unlink_while_writer_runs(paths):
+        if not calls:
+            # A still-running task writes into a directory that was already scanned
+            (root / "late.txt").write_text("caption")
+        calls.append(paths)
+        return original(paths)
+
+    monkeypatch.setattr(storage, "_unlink_all", unlink_while_writer_runs)
+    assert remove_tree_parallel(str(root)) == 2
+    assert not root.exists()
@@ -0,0 +1,93 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+import app.models as models
+from app.models import InstrumentedQueuePool, build_engine, pool_status
+from app.worker import reset_db_pool_in_child
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_pool_settings_are_applied(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'pool.db'}", pool_size=3, max_overflow=2, pool_recycle=60)
+    assert isinstance(engine.pool, InstrumentedQueuePool)
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 2
+    assert engine.pool._recycle == 60
+    engine.dispose()
+
+
+def test_pool_status_reports_usage_and_waits(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=1, pool_timeout=0.05)
+
+    first = engine.connect()
+    second = engine.connect() # Served from overflow
+    status = pool_status(engine)
+    assert status["checked_out"] == 2
+    assert status["overflow"] == 1
+    assert status["checkouts"] == 2
+
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    status = pool_status(engine)
+    assert status["timeouts"] == 1
+    assert status["wait_seconds_max"] >= 0.05
+
+    first.close()
+    second.close()
+    assert pool_status(engine)["checked_out"] == 0
+    engine.dispose()
+
+
+def test_worker_child_gets_fresh_pool(tmp_path, monkeypatch):
+    engine = build_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    monkeypatch.setattr(models, "_engine", engine)
+    connection = engine.connect()
+    connection.close()
+    inherited_pool = engine.pool
+    assert inherited_pool.checkedin() == 1
+
+    reset_db_pool_in_child()
+
+    assert engine.pool is not inherited_pool
+    assert engine.pool.checkedin() == 0
+    assert engine.pool.metrics.checkouts == 0
+    assert engine.pool.engine_name == inherited_pool.engine_name
+    inherited_pool.dispose()
+    engine.dispose()
+
+
+def test_engines_keep_separate_metrics(tmp_path):
+    api = build_engine(f"sqlite:///{tmp_path / 'api.db'}", name="api")
+    batch = build_engine(f"sqlite:///{tmp_path / 'batch.db'}", name="batch")
+    api.connect().close()
+    api.connect().close()
+    batch.connect().close()
+
+    assert (pool_status(api)["engine"], pool_status(api)["checkouts"]) == ("api", 2)
+    assert (pool_status(batch)["engine"], pool_status(batch)["checkouts"]) == ("batch", 1)
+    api.dispose()
+    batch.dispose()
+
+
+def test_pool_metrics_are_exported_to_prometheus(tmp_path):
+    engine = build_engine(f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=1, pool_timeout=0.05, name="exported")
+    acquired_before = sample("loraforge_db_pool_wait_seconds_count", engine="exported", outcome="acquired")
+
+    first = engine.connect()
+    second = engine.connect()
+    assert sample("loraforge_db_pool_connections", engine="exported", state="checked_out") == 2
+    assert sample("loraforge_db_pool_connections", engine="exported", state="overflow") == 1
+    with pytest.raises(PoolTimeoutError):
+        engine.connect()
+    assert sample("loraforge_db_pool_wait_seconds_count", engine="exported", outcome="acquired") == acquired_before + 2
+    assert sample("loraforge_db_pool_wait_seconds_count", engine="exported", outcome="timeout") == 1
+
+    first.close()
+    second.close()
+    assert sample("loraforge_db_pool_connections", engine="exported", state="checked_out") == 0
+    assert sample("loraforge_db_pool_connections", engine="exported", state="checked_in") == 1
+    engine.dispose()
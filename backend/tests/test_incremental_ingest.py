@@ -0,0 +1,200 @@
+import io
+import os
+import json
+import tarfile
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.ingest as ingest
+import app.main as main
+import app.worker as worker
+from app.main import app, get_db
+from app.models import Dataset, Image, BackgroundTask, TaskStatus
+from app.worker import add_files_to_dataset, process_dataset_upload
+from app.storage import hash_file
+from conftest import png_bytes, write_zip
+
+
+@pytest.fixture(name="client")
+def client_fixture(db_session, tmp_path, monkeypatch):
+    sent_tasks = []
+    monkeypatch.setattr(
+        main.celery_app, "send_task",
+        lambda name, args: sent_tasks.append((name, args)) or SimpleNamespace(id=str(uuid.uuid4())),
+    )
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(uploads))
+    app.dependency_overrides[get_db] = lambda: db_session
+    client = TestClient(app)
+    client.sent_tasks = sent_tasks
+    yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(name="probe_calls")
+def probe_calls_fixture(monkeypatch):
+    calls = []
+    original = ingest.probe_file
+    monkeypatch.setattr(ingest, "probe_file", lambda path: calls.append(path) or original(path))
+    return calls
+
+
+@pytest.fixture(name="base_files")
+def base_files_fixture():
+    return {
+        "red.png": png_bytes("red"),
+        "nested/blue.png": png_bytes("blue"),
+        "nested/deeper/green.png": png_bytes("green", size=(16, 9)),
+        "notes.txt": b"caption",
+        "junk.bin": b"\x00\x01\x02",
+    }
+
+
+@pytest.fixture(name="dataset")
+def dataset_fixture(db_session, tmp_path, monkeypatch, base_files):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+
+    archive = write_zip(tmp_path / "initial.zip", base_files)
+    result = process_dataset_upload(str(task.id), archive, "initial.zip", "Incremental", db=db_session)
+    assert result["status"] == "success"
+    return db_session.query(Dataset).filter(Dataset.id == uuid.UUID(result["dataset_id"])).first()
+
+
+def test_initial_ingest_records_relative_paths_sizes_and_hashes(db_session, dataset, base_files, tmp_path):
+    images = {image.path: image for image in db_session.query(Image).all()}
+    assert set(images) == {"red.png", "nested/blue.png", "nested/deeper/green.png", "notes.txt"}
+    green = images["nested/deeper/green.png"]
+    assert green.filename == "green.png"
+    assert (green.width, green.height) == (16, 9)
+    assert green.size_bytes == len(base_files["nested/deeper/green.png"])
+    assert len(green.content_hash) == 64
+    assert green.mtime_ns == os.stat(tmp_path / "datasets" / str(dataset.id) / green.path).st_mtime_ns
+
+
+def test_add_files_only_processes_the_delta(client, db_session, dataset, base_files, tmp_path, probe_calls):
+    files = dict(base_files)
+    files["nested/blue.png"] = png_bytes("navy", size=(4, 4)) # Changed
+    files["new/yellow.png"] = png_bytes("yellow") # Added
+    files["../escape.png"] = png_bytes("black") # Unsafe, ignored
+    archive = write_zip(tmp_path / "delta.zip", files)
+
+    with open(archive, "rb") as f:
+        response = client.post(f"/v1/datasets/{dataset.id}/files", files={"file": ("delta.zip", f, "application/zip")})
+    assert response.status_code == 202
+    name, args = client.sent_tasks[0]
+    assert name == "worker.app.worker.add_files_to_dataset"
+
+    result = add_files_to_dataset(*args, db=db_session)
+    assert result["status"] == "success"
+    assert (result["added"], result["updated"], result["skipped"]) == (1, 1, 3)
+    # junk.bin has no row, so it is re-examined; every unchanged known file is skipped without probing
+    assert sorted(os.path.basename(p) for p in probe_calls) == ["blue.png", "junk.bin", "yellow.png"]
+    assert not (tmp_path / "datasets" / "escape.png").exists()
+
+    images = {image.path: image for image in db_session.query(Image).filter(Image.dataset_id == dataset.id).all()}
+    assert len(images) == 5
+    assert (images["nested/blue.png"].width, images["nested/blue.png"].height) == (4, 4)
+    assert "new/yellow.png" in images
+
+    task = db_session.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(args[0])).first()
+    assert task.status == TaskStatus.SUCCESS.value
+    assert json.loads(task.result)["added"] == 1
+
+
+def test_add_files_rejects_unknown_dataset(client):
+    response = client.post(f"/v1/datasets/{uuid.uuid4()}/files", files={"file": ("x.zip", b"", "application/zip")})
+    assert response.status_code == 404
+    assert client.sent_tasks == []
+
+
+def run_add_files(db_session, dataset, archive):
+    task = BackgroundTask(task_name="add_files_to_dataset")
+    db_session.add(task)
+    db_session.commit()
+    return add_files_to_dataset(str(task.id), str(dataset.id), archive, os.path.basename(archive), db=db_session)
+
+
+def test_unchanged_files_are_compared_without_touching_disk(db_session, dataset, base_files, tmp_path, monkeypatch):
+    dataset_dir = tmp_path / "datasets" / str(dataset.id)
+    before = {name: os.stat(dataset_dir / name).st_ino for name in base_files}
+    spools, replaced = [], []
+    spooled_file = ingest.tempfile.SpooledTemporaryFile
+    monkeypatch.setattr(ingest.tempfile, "SpooledTemporaryFile", lambda **kw: spools.append(kw) or spooled_file(**kw))
+    monkeypatch.setattr(ingest, "replace_from", lambda source, dest_path: replaced.append(dest_path))
+
+    files = dict(base_files)
+    files["red.png"] = png_bytes("orange", size=(30, 30)) # Header size differs: no comparison needed
+    result = run_add_files(db_session, dataset, write_zip(tmp_path / "same.zip", files))
+    assert (result["added"], result["updated"], result["skipped"]) == (0, 1, 3)
+
+    # Only the same-size known files were hashed in memory, and none of them was rewritten
+    assert len(spools) == 3
+    assert replaced == []
+    assert all(os.stat(dataset_dir / name).st_ino == inode for name, inode in before.items() if name != "red.png")
+    assert (dataset_dir / "red.png").read_bytes() == files["red.png"]
+    assert not list(dataset_dir.rglob("*.ingest-partial"))
+
+
+def test_same_size_change_is_detected_by_hash(db_session, dataset, base_files, tmp_path):
+    files = dict(base_files)
+    files["notes.txt"] = b"CAPTION" # Same length as before
+    result = run_add_files(db_session, dataset, write_zip(tmp_path / "edit.zip", files))
+    assert result["updated"] == 1
+    assert (tmp_path / "datasets" / str(dataset.id) / "notes.txt").read_bytes() == b"CAPTION"
+
+
+def test_legacy_rows_get_sizes_and_hashes_backfilled(db_session, dataset, base_files, tmp_path, monkeypatch):
+    db_session.query(Image).update({"size_bytes": None, "content_hash": None}, synchronize_session=False)
+    db_session.commit()
+    result = run_add_files(db_session, dataset, write_zip(tmp_path / "again.zip", base_files))
+    assert (result["updated"], result["skipped"], result["backfilled"]) == (0, 4, 4)
+    for image in db_session.query(Image).all():
+        db_session.refresh(image)
+        assert image.size_bytes == len(base_files[image.path])
+        assert len(image.content_hash) == 64
+
+    # The next re-ingest trusts the stored hashes instead of re-reading files on disk
+    hashed = []
+    monkeypatch.setattr(ingest, "hash_file", lambda path: hashed.append(path))
+    result = run_add_files(db_session, dataset, write_zip(tmp_path / "again.zip", base_files))
+    assert result["backfilled"] == 0
+    assert hashed == []
+
+
+def test_repeated_member_names_keep_the_last_entry(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    first, last = png_bytes("red"), png_bytes("blue", size=(3, 3))
+    archive = tmp_path / "appended.tar"
+    with tarfile.open(archive, "w") as tar: # As left by `tar -rf`: the same name twice
+        for name, content in (("a.png", first), ("./a.png", last)):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+
+    result = process_dataset_upload(str(task.id), str(archive), "appended.tar", "Appended", db=db_session)
+    assert result["status"] == "success"
+    image = db_session.query(Image).one()
+    assert (image.path, image.width, image.size_bytes) == ("a.png", 3, len(last))
+    assert (tmp_path / "datasets" / result["dataset_id"] / "a.png").read_bytes() == last
+
+
+def test_repeated_member_names_on_re_ingest(db_session, dataset, base_files, tmp_path):
+    # The changed copy comes first; the unchanged one after it must still end up on disk
+    archive = write_zip(tmp_path / "dupes.zip", {"red.png": png_bytes("orange"), "./red.png": base_files["red.png"]})
+    result = run_add_files(db_session, dataset, archive)
+    assert result["status"] == "success"
+    red_path = tmp_path / "datasets" / str(dataset.id) / "red.png"
+    assert red_path.read_bytes() == base_files["red.png"]
+    red = db_session.query(Image).filter(Image.dataset_id == dataset.id, Image.path == "red.png").one()
+    db_session.refresh(red)
+    assert red.content_hash == hash_file(str(red_path))
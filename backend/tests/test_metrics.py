@@ -0,0 +1,93 @@
+import fcntl
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import app.metrics as metrics
+import app.worker as worker
+from app.main import app
+from app.metrics import StageTimer
+from app.models import BackgroundTask
+from app.worker import process_dataset_upload
+from conftest import png_bytes, write_zip
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_stage_timer_accumulates_and_publishes():
+    timer = StageTimer("unit_test")
+    for _ in range(3):
+        with timer.stage("probe"):
+            pass
+    with timer.stage("insert"):
+        pass
+    timer.count(files=3, size=300)
+    before = sample("loraforge_task_stage_seconds_count", task="unit_test", stage="probe")
+
+    summary = timer.finish()
+    assert set(summary["stages"]) == {"probe", "insert"}
+    assert summary["files"] == 3
+    assert summary["bytes"] == 300
+    assert summary["files_per_second"] > 0
+    # One observation per stage per run, however many times the stage was entered
+    assert sample("loraforge_task_stage_seconds_count", task="unit_test", stage="probe") == before + 1
+
+
+def test_ingest_reports_stage_timings(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    archive = write_zip(tmp_path / "upload.zip", {f"img{i}.png": png_bytes("red", (4, 4)) for i in range(4)})
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+    files_before = sample("loraforge_task_files_total", task="process_dataset_upload")
+
+    result = process_dataset_upload(str(task.id), archive, "upload.zip", "Timed", db=db_session)
+    assert result["status"] == "success"
+    assert set(result["timings"]["stages"]) == {"unpack", "probe", "insert", "snapshot", "cleanup"}
+    assert sample("loraforge_task_files_total", task="process_dataset_upload") == files_before + 4
+
+    db_session.refresh(task)
+    assert task.result.startswith(f"Dataset 'Timed' with ID {result['dataset_id']} processed successfully.")
+    timings = json.loads(task.result.split("Timings: ", 1)[1])
+    assert timings["files"] == 4
+
+
+def test_metrics_endpoint_reports_route_latency():
+    client = TestClient(app)
+    before = sample("loraforge_http_request_seconds_count", method="GET", route="/health", status="200")
+    client.get("/health")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'loraforge_http_request_seconds_count{method="GET",route="/health",status="200"}' in response.text
+    assert sample("loraforge_http_request_seconds_count", method="GET", route="/health", status="200") == before + 1
+
+
+def test_reset_multiproc_dir_clears_stale_samples_unless_shared(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "_multiproc_lock", None)
+    (tmp_path / "counter_4242.db").write_bytes(b"stale")
+    (tmp_path / "histogram_4242.db").write_bytes(b"stale")
+
+    # Another live worker holds the directory: leave its samples alone
+    with open(tmp_path / metrics.MULTIPROC_LOCK_FILENAME, "w") as other:
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        assert metrics.reset_multiproc_dir() is False
+        assert sorted(os.listdir(tmp_path)) == [metrics.MULTIPROC_LOCK_FILENAME, "counter_4242.db", "histogram_4242.db"]
+
+    try:
+        assert metrics.reset_multiproc_dir() is True
+        assert os.listdir(tmp_path) == [metrics.MULTIPROC_LOCK_FILENAME]
+        # Only the first call in a process wipes the directory
+        (tmp_path / "counter_4243.db").write_bytes(b"live")
+        assert metrics.reset_multiproc_dir() is False
+        assert (tmp_path / "counter_4243.db").exists()
+    finally:
+        if metrics._multiproc_lock is not None:
+            metrics._multiproc_lock.close()
@@ -0,0 +1,259 @@
+import uuid
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, UUID, create_engine, event, func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from app.clear_db import clear_database_tables
+from app.migrate import alembic_config, stamp_legacy_database, upgrade_database
+from app.models import Base, Dataset, Image, BackgroundTask, TaskStatus
+from conftest import png_bytes
+
+
+def baseline_metadata():
+    """The tables the pre-migration per-startup create_all produced."""
+    metadata = MetaData()
+    Table(
+        "datasets", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("name", String, nullable=False),
+        Column("source_path", String, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    )
+    Table(
+        "images", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        # Postgres names the unnamed baseline key images_dataset_id_fkey; SQLite needs it spelled out
+        Column("dataset_id", UUID(as_uuid=True), ForeignKey("datasets.id", name="images_dataset_id_fkey"), nullable=False),
+        Column("filename", String, nullable=False),
+        Column("path", String, nullable=False),
+        Column("width", Integer),
+        Column("height", Integer),
+        Column("mime_type", String, nullable=True),
+    )
+    Table(
+        "background_tasks", metadata,
+        Column("id", UUID(as_uuid=True), primary_key=True),
+        Column("task_name", String, nullable=False),
+        Column("status", String, nullable=False),
+        Column("progress", Integer, nullable=False),
+        Column("result", Text, nullable=True),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    )
+    return metadata
+
+
+def schema_diff(engine, metadata):
+    with engine.connect() as connection:
+        # SQLite reflects UUID columns as NUMERIC, so only compare tables, columns, indexes and keys
+        context = MigrationContext.configure(connection, opts={"compare_type": False})
+        return compare_metadata(context, metadata)
+
+
+@pytest.fixture(name="migrated_engine")
+def migrated_engine_fixture(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    config = alembic_config(url)
+    command.upgrade(config, "head")
+
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def enable_foreign_keys(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+    yield engine
+    engine.dispose()
+    command.downgrade(config, "base")
+
+
+def explain(session, query):
+    """Returns SQLite's query plan for an ORM query as a single string."""
+    statement = query.statement.compile(session.bind, compile_kwargs={"literal_binds": True})
+    rows = session.execute(text(f"EXPLAIN QUERY PLAN {statement}")).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_migrations_match_models(migrated_engine):
+    assert schema_diff(migrated_engine, Base.metadata) == []
+
+
+def test_initial_revision_is_the_baseline_schema(tmp_path):
+    url = f"sqlite:///{tmp_path / 'baseline.db'}"
+    command.upgrade(alembic_config(url), "0001")
+    engine = create_engine(url)
+    assert schema_diff(engine, baseline_metadata()) == []
+    engine.dispose()
+
+
+def test_stamped_baseline_database_upgrades_to_head(tmp_path):
+    url = f"sqlite:///{tmp_path / 'stamped.db'}"
+    engine = create_engine(url)
+    baseline_metadata().create_all(bind=engine)
+
+    config = alembic_config(url)
+    command.stamp(config, "0001")
+    command.upgrade(config, "head")
+    assert schema_diff(engine, Base.metadata) == []
+    engine.dispose()
+
+
+def test_startup_upgrade_stamps_databases_created_before_migrations(tmp_path):
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = create_engine(url)
+    baseline_metadata().create_all(bind=engine)
+    dataset_id = uuid.uuid4()
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO datasets (id, name, source_path) VALUES (:id, 'Legacy', 'legacy.zip')"),
+            {"id": dataset_id.hex},
+        )
+
+    upgrade_database(url)
+    assert schema_diff(engine, Base.metadata) == []
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT name FROM datasets")).scalar_one() == "Legacy"
+        head = connection.execute(text("SELECT version_num FROM alembic_version")).scalar_one()
+
+    # Later starts find alembic_version and just upgrade
+    assert stamp_legacy_database(url) is False
+    upgrade_database(url)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).scalar_one() == head
+    engine.dispose()
+
+
+def test_startup_upgrade_builds_empty_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    assert stamp_legacy_database(url) is False
+    upgrade_database(url)
+    engine = create_engine(url)
+    assert schema_diff(engine, Base.metadata) == []
+    engine.dispose()
+
+
+def test_startup_upgrade_refuses_partial_baseline(tmp_path):
+    url = f"sqlite:///{tmp_path / 'partial.db'}"
+    engine = create_engine(url)
+    metadata = baseline_metadata()
+    metadata.tables["datasets"].create(bind=engine)
+    engine.dispose()
+    with pytest.raises(RuntimeError, match="images"):
+        upgrade_database(url)
+
+
+def test_hot_queries_use_indexes(migrated_engine):
+    db = sessionmaker(bind=migrated_engine)()
+    dataset_id = uuid.uuid4()
+
+    # Either index leading with dataset_id serves the plain listing
+    plan = explain(db, db.query(Image).filter(Image.dataset_id == dataset_id))
+    assert "USING INDEX ix_images_dataset_id_width_height" in plan or "USING INDEX uq_images_dataset_id_path" in plan
+
+    plan = explain(db, db.query(Image).filter(Image.dataset_id == dataset_id, Image.width >= 1024))
+    assert "USING INDEX ix_images_dataset_id_width_height" in plan
+
+    plan = explain(db, db.query(BackgroundTask).filter(BackgroundTask.id == uuid.uuid4()))
+    assert "USING INDEX sqlite_autoindex_background_tasks_1" in plan
+
+    plan = explain(
+        db,
+        db.query(BackgroundTask)
+        .filter(BackgroundTask.status == TaskStatus.RUNNING.value)
+        .order_by(BackgroundTask.created_at.desc()),
+    )
+    assert "USING INDEX ix_background_tasks_status_created_at" in plan
+    assert "TEMP B-TREE" not in plan # Ordering comes straight from the index
+    db.close()
+
+
+def test_deleting_dataset_cascades_to_images(migrated_engine):
+    db = sessionmaker(bind=migrated_engine)()
+    dataset = Dataset(name="Cascade", source_path="cascade.zip")
+    db.add(dataset)
+    db.add_all([Image(dataset=dataset, filename=f"{i}.png", path=f"{i}.png") for i in range(3)])
+    db.commit()
+
+    db.delete(dataset)
+    db.commit()
+    assert db.query(Image).count() == 0
+    db.close()
+
+
+def test_clear_db_recovers_half_dropped_database(tmp_path):
+    url = f"sqlite:///{tmp_path / 'cleared.db'}"
+    command.upgrade(alembic_config(url), "head")
+    engine = create_engine(url)
+    db = sessionmaker(bind=engine)()
+    db.add(Dataset(name="Old", source_path="old.zip"))
+    db.commit()
+    db.close()
+    # What the previous version of the script left behind: datasets gone, alembic_version still at head
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE images"))
+        connection.execute(text("DROP TABLE datasets"))
+
+    clear_database_tables(url)
+
+    assert schema_diff(engine, Base.metadata) == []
+    db = sessionmaker(bind=engine)()
+    assert db.query(Dataset).count() == 0
+    db.close()
+    engine.dispose()
+
+
+def insert_legacy_images(connection, dataset_id, paths):
+    connection.execute(
+        text("INSERT INTO datasets (id, name, source_path) VALUES (:id, 'Legacy', 'legacy.zip')"),
+        {"id": dataset_id.hex},
+    )
+    for path in paths:
+        connection.execute(
+            text("INSERT INTO images (id, dataset_id, filename, path, width, height) VALUES (:id, :dataset_id, :path, :path, 1, 1)"),
+            {"id": uuid.uuid4().hex, "dataset_id": dataset_id.hex, "path": path},
+        )
+
+
+def test_path_uniqueness_migration_rebuilds_legacy_paths(tmp_path, monkeypatch):
+    datasets_dir = tmp_path / "datasets"
+    monkeypatch.setenv("DATASETS_DIR", str(datasets_dir))
+    url = f"sqlite:///{tmp_path / 'duplicates.db'}"
+    config = alembic_config(url)
+    command.upgrade(config, "0004")
+    engine = create_engine(url)
+
+    # Legacy ingest stored bare file names, so nested files collapsed onto one path
+    on_disk = {"a.png": (4, 4), "left/a.png": (5, 5), "right/deep/a.png": (6, 6), "nested/b.png": (7, 7)}
+    dataset_id = uuid.uuid4()
+    for path, size in on_disk.items():
+        (datasets_dir / str(dataset_id) / path).parent.mkdir(parents=True, exist_ok=True)
+        (datasets_dir / str(dataset_id) / path).write_bytes(png_bytes("red", size))
+    # A dataset whose files are not on this machine keeps one row per path
+    missing_id = uuid.uuid4()
+    with engine.begin() as connection:
+        insert_legacy_images(connection, dataset_id, ["a.png", "a.png", "a.png", "a.png", "b.png"])
+        insert_legacy_images(connection, missing_id, ["a.png", "a.png", "b.png"])
+
+    command.upgrade(config, "head")
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text("SELECT path, width, height FROM images WHERE dataset_id = :id"), {"id": dataset_id.hex}
+        ).all()
+        missing_paths = sorted(path for (path,) in connection.execute(
+            text("SELECT path FROM images WHERE dataset_id = :id"), {"id": missing_id.hex}
+        ))
+    # Every file gets its row back; the one row no file accounts for is dropped
+    assert sorted(rows) == [("a.png", 4, 4), ("left/a.png", 5, 5), ("nested/b.png", 1, 1), ("right/deep/a.png", 6, 6)]
+    assert missing_paths == ["a.png", "b.png"]
+
+    db = sessionmaker(bind=engine)()
+    db.add(Image(dataset_id=dataset_id, filename="b.png", path="nested/b.png"))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.close()
+    engine.dispose()
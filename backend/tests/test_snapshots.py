@@ -0,0 +1,159 @@
+import os
+import threading
+import uuid
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip("pyarrow")
+
+import app.snapshots as snapshots
+import app.worker as worker
+from app.models import BackgroundTask, Image
+from app.snapshots import open_snapshot, refresh_snapshot, snapshot_path
+from app.worker import add_files_to_dataset, process_dataset_upload, rebuild_dataset_snapshot
+from conftest import png_bytes, write_zip
+
+
+def new_task(db_session, name):
+    task = BackgroundTask(task_name=name)
+    db_session.add(task)
+    db_session.commit()
+    return str(task.id)
+
+
+def snapshot_rows(dataset_dir):
+    snapshot = open_snapshot(dataset_dir)
+    categories = snapshot.categories()
+    return {
+        path: (int(width), int(height), int(size), categories[code], int(caption_length))
+        for path, width, height, size, code, caption_length in zip(
+            snapshot.array("path"), snapshot.array("width"), snapshot.array("height"),
+            snapshot.array("size_bytes"), snapshot.array("mime_type"), snapshot.array("caption_length"),
+        )
+    }
+
+
+@pytest.fixture(name="dataset_dir")
+def dataset_dir_fixture(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    archive = write_zip(tmp_path / "initial.zip", {
+        "red.png": png_bytes("red"),
+        "nested/blue.png": png_bytes("blue", (16, 9)),
+        "notes.txt": b"caption",
+    })
+    result = process_dataset_upload(new_task(db_session, "process_dataset_upload"), archive, "initial.zip", "Snap", db=db_session)
+    assert result["status"] == "success"
+    assert "snapshot" in result["timings"]["stages"]
+    return str(tmp_path / "datasets" / result["dataset_id"])
+
+
+def test_ingest_writes_snapshot(dataset_dir):
+    rows = snapshot_rows(dataset_dir)
+    assert set(rows) == {"red.png", "nested/blue.png", "notes.txt"}
+    assert rows["nested/blue.png"][:2] == (16, 9)
+    assert rows["nested/blue.png"][3] == "image/png"
+    # Unknown dimensions are stored as 0 rather than null
+    assert rows["notes.txt"][:2] == (0, 0)
+    assert all(caption_length == 0 for *_, caption_length in rows.values())
+
+
+def test_numeric_columns_are_zero_copy(dataset_dir):
+    snapshot = open_snapshot(dataset_dir)
+    for name in ("width", "height", "size_bytes", "caption_length", "mime_type"):
+        array = snapshot.array(name)
+        assert len(array) == len(snapshot)
+        assert not array.flags.owndata
+        assert not array.flags.writeable # A view of the read-only mapping
+
+
+def test_open_snapshot_without_file(tmp_path):
+    assert open_snapshot(str(tmp_path)) is None
+
+
+def test_add_files_refreshes_only_changed_rows(db_session, dataset_dir, tmp_path, monkeypatch):
+    queried = []
+    original = snapshots._query_rows
+    monkeypatch.setattr(snapshots, "_query_rows", lambda db, dataset_id, image_ids=None: queried.append(image_ids) or original(db, dataset_id, image_ids))
+
+    dataset_id = os.path.basename(dataset_dir)
+    archive = write_zip(tmp_path / "delta.zip", {
+        "red.png": png_bytes("red"), # Unchanged
+        "nested/blue.png": png_bytes("navy", (4, 4)), # Changed
+        "new/yellow.png": png_bytes("yellow", (3, 5)), # Added
+    })
+    result = add_files_to_dataset(new_task(db_session, "add_files_to_dataset"), dataset_id, archive, "delta.zip", db=db_session)
+    assert (result["added"], result["updated"], result["skipped"]) == (1, 1, 1)
+
+    assert len(queried) == 1 and len(queried[0]) == 2
+    rows = snapshot_rows(dataset_dir)
+    assert rows["nested/blue.png"][:2] == (4, 4)
+    assert rows["new/yellow.png"][:2] == (3, 5)
+    assert set(rows) == {"red.png", "nested/blue.png", "notes.txt", "new/yellow.png"}
+
+
+def test_row_count_drift_forces_full_rebuild(db_session, dataset_dir):
+    dataset_id = uuid.UUID(os.path.basename(dataset_dir))
+    db_session.query(Image).filter(Image.path == "red.png").delete()
+    db_session.commit()
+
+    assert refresh_snapshot(db_session, dataset_id, dataset_dir, changed_ids=[]) == 2
+    assert set(snapshot_rows(dataset_dir)) == {"nested/blue.png", "notes.txt"}
+
+
+def test_captions_update_snapshot(db_session, dataset_dir):
+    dataset_id = uuid.UUID(os.path.basename(dataset_dir))
+    image = db_session.query(Image).filter(Image.path == "red.png").first()
+    image.caption = "a red square"
+    db_session.commit()
+
+    refresh_snapshot(db_session, dataset_id, dataset_dir, changed_ids=[image.id])
+    assert snapshot_rows(dataset_dir)["red.png"][4] == len("a red square")
+
+
+def test_unreadable_snapshot_is_rebuilt(db_session, dataset_dir):
+    with open(snapshot_path(dataset_dir), "wb") as f:
+        f.write(b"not arrow")
+    assert open_snapshot(dataset_dir) is None
+    result = rebuild_dataset_snapshot(os.path.basename(dataset_dir), db=db_session)
+    assert result == {"status": "success", "dataset_id": os.path.basename(dataset_dir), "rows": 3}
+    assert len(open_snapshot(dataset_dir)) == 3
+
+
+def test_concurrent_refreshes_leave_a_valid_snapshot(db_session, dataset_dir):
+    dataset_id = uuid.UUID(os.path.basename(dataset_dir))
+    engine = db_session.get_bind()
+    errors = []
+
+    def refresh():
+        db = sessionmaker(bind=engine)()
+        try:
+            for _ in range(10):
+                refresh_snapshot(db, dataset_id, dataset_dir)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=refresh) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(open_snapshot(dataset_dir)) == 3
+    assert not [name for name in os.listdir(dataset_dir) if name.endswith(".partial")]
+
+
+def test_snapshot_failure_does_not_fail_ingest(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+
+    def broken_refresh(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(worker, "refresh_snapshot", broken_refresh)
+    archive = write_zip(tmp_path / "upload.zip", {"red.png": png_bytes("red")})
+    result = process_dataset_upload(new_task(db_session, "process_dataset_upload"), archive, "upload.zip", "Snap", db=db_session)
+    assert result["status"] == "success"
+    assert db_session.query(Image).count() == 1
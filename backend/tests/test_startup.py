@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import text
+
+import app.models as models
+from app.models import SessionLocal, build_engine
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Absolute import times swing by a few hundred ms between runs, so each entry point is
+# bounded relative to the third-party stack it cannot avoid importing, measured alongside it.
+# The app's own modules currently add up to about 15% on top.
+FRAMEWORK_IMPORTS = {
+    "app.main": "fastapi, celery.app, sqlalchemy.orm, pydantic, prometheus_client",
+    "app.worker": "celery.app, sqlalchemy.orm, pydantic, prometheus_client",
+}
+MAX_OVERHEAD_RATIO = float(os.environ.get("STARTUP_MAX_OVERHEAD_RATIO", "1.5"))
+IMPORT_RUNS = 3 # Best of N, to ride out a noisy neighbour
+
+# Only the stages that need these may import them
+LAZY_MODULES = ("PIL", "magic", "httpx", "pyarrow", "numpy", "psycopg2")
+
+
+def import_profile(statement: str) -> dict:
+    """
+    Runs `statement` in a fresh interpreter under -X importtime. Returns {module: cumulative ms},
+    with the statement's total under the key None.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    )
+    profile = {None: 0.0}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        profile[name.strip()] = int(cumulative) / 1000
+        if not name[1:].startswith(" "): # Nested imports are already in their parent's cumulative time
+            profile[None] += int(cumulative) / 1000
+    return profile
+
+
+@pytest.mark.parametrize("module", sorted(FRAMEWORK_IMPORTS))
+def test_import_time_relative_to_frameworks(module):
+    app_ms, framework_ms = float("inf"), float("inf")
+    for _ in range(IMPORT_RUNS): # Interleaved, so both see the same machine load
+        app_ms = min(app_ms, import_profile(f"import {module}")[None])
+        framework_ms = min(framework_ms, import_profile(f"import {FRAMEWORK_IMPORTS[module]}")[None])
+    print(f"import {module}: {app_ms:.0f} ms; its frameworks alone: {framework_ms:.0f} ms ({app_ms / framework_ms:.2f}x)")
+    assert app_ms <= framework_ms * MAX_OVERHEAD_RATIO, (
+        f"import {module} took {app_ms:.0f} ms, {app_ms / framework_ms:.2f}x the {framework_ms:.0f} ms of "
+        f"{FRAMEWORK_IMPORTS[module]} (limit {MAX_OVERHEAD_RATIO}x)"
+    )
+
+
+def test_heavy_dependencies_are_not_imported_at_startup():
+    profile = import_profile("import app.main, app.worker")
+    assert [name for name in LAZY_MODULES if name in profile] == []
+
+
+def test_session_binds_engine_on_first_use(tmp_path, monkeypatch):
+    engine = build_engine(f"sqlite:///{tmp_path / 'lazy.db'}")
+    monkeypatch.setattr(models, "_engine", engine)
+    db = SessionLocal()
+    try:
+        assert db.bind is None
+        assert db.execute(text("SELECT 1")).scalar() == 1
+        assert db.bind is engine
+        assert models.engine is engine
+    finally:
+        db.close()
+        engine.dispose()
@@ -0,0 +1,85 @@
+import shutil
+import uuid
+
+import pytest
+
+from app.celery_config import CPU_BATCH_QUEUE, INGEST_QUEUE, INTERACTIVE_QUEUE, PRIORITY_LOW, PRIORITY_NORMAL
+from app.main import celery_app as api_celery_app
+from app.models import BackgroundTask, Dataset, Image, TaskStatus
+from app.worker import celery_app as worker_celery_app
+import app.worker as worker
+from conftest import png_bytes, write_zip
+
+
+@pytest.mark.parametrize("celery_app", [api_celery_app, worker_celery_app], ids=["api", "worker"])
+@pytest.mark.parametrize("task_name, queue, priority", [
+    ("worker.app.worker.process_dataset_upload", INGEST_QUEUE, PRIORITY_LOW),
+    ("worker.app.worker.add_files_to_dataset", INGEST_QUEUE, PRIORITY_NORMAL),
+    ("worker.app.worker.delete_dataset", INGEST_QUEUE, PRIORITY_NORMAL),
+    ("worker.app.worker.caption_dataset_images", CPU_BATCH_QUEUE, PRIORITY_NORMAL),
+    ("worker.app.worker.rebuild_dataset_snapshot", CPU_BATCH_QUEUE, PRIORITY_LOW),
+    ("app.worker.add", INTERACTIVE_QUEUE, None),
+])
+def test_tasks_are_routed_to_their_queue(celery_app, task_name, queue, priority):
+    # The producer's routing decides where send_task publishes, so both apps must agree
+    route = celery_app.amqp.router.route({}, task_name, (), {})
+    assert route["queue"].name == queue
+    assert route["queue"].routing_key == queue
+    assert route.get("priority") == priority
+
+
+def test_long_tasks_ack_late_with_single_prefetch():
+    for task in (worker.process_dataset_upload, worker.add_files_to_dataset, worker.delete_dataset, worker.caption_dataset_images):
+        assert task.acks_late
+    assert worker_celery_app.conf.worker_prefetch_multiplier == 1
+    # Redis must not redeliver a multi-hour ingest that is still running
+    assert worker_celery_app.conf.broker_transport_options["visibility_timeout"] >= 3 * 3600
+
+
+@pytest.fixture(name="upload")
+def upload_fixture(db_session, tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "DATASETS_DIR", str(tmp_path / "datasets"))
+    archive = write_zip(tmp_path / "upload.zip", {"red.png": png_bytes("red"), "blue.png": png_bytes("blue")})
+    shutil.copy(archive, tmp_path / "original.zip") # The task deletes its archive when it finishes
+    task = BackgroundTask(task_name="process_dataset_upload")
+    db_session.add(task)
+    db_session.commit()
+    return str(task.id), archive
+
+
+def test_redelivered_upload_is_not_ingested_twice(db_session, upload, tmp_path):
+    task_id, archive = upload
+    first = worker.process_dataset_upload(task_id, archive, "upload.zip", "Once", db=db_session)
+    assert first["status"] == "success"
+    assert first["dataset_id"] == task_id
+
+    # The worker died before acking: the same message arrives again
+    shutil.copy(tmp_path / "original.zip", archive)
+    second = worker.process_dataset_upload(task_id, archive, "upload.zip", "Once", db=db_session)
+    assert second["status"] == "skipped"
+    assert db_session.query(Dataset).count() == 1
+    assert db_session.query(Image).count() == 2
+
+
+def test_interrupted_upload_resumes_the_same_dataset(db_session, upload, tmp_path, monkeypatch):
+    task_id, archive = upload
+    store_files = worker.store_files
+
+    def lose_worker(*args, **kwargs):
+        # Not an Exception, so the task's own error handling doesn't mark it failed
+        raise SystemExit("worker lost")
+
+    # Simulate a worker lost between creating the dataset and storing its rows
+    monkeypatch.setattr(worker, "store_files", lose_worker)
+    with pytest.raises(SystemExit):
+        worker.process_dataset_upload(task_id, archive, "upload.zip", "Resumed", db=db_session)
+    db_session.rollback()
+    task = db_session.query(BackgroundTask).filter(BackgroundTask.id == uuid.UUID(task_id)).one()
+    assert task.status == TaskStatus.RUNNING.value
+    monkeypatch.setattr(worker, "store_files", store_files)
+
+    result = worker.process_dataset_upload(task_id, archive, "upload.zip", "Resumed", db=db_session)
+    assert result["status"] == "success"
+    assert [dataset.id for dataset in db_session.query(Dataset).all()] == [uuid.UUID(task_id)]
+    assert sorted(image.path for image in db_session.query(Image).all()) == ["blue.png", "red.png"]
+    assert sorted(p.name for p in (tmp_path / "datasets").iterdir()) == [task_id]
@@ -105,7 +105,7 @@ const UploadModal = () => {
                 {isDragActive ? (
                   <Typography>Drop the files here ...</Typography>
                 ) : (
-                  <Typography>Drag & drop a zip file here, or click to select</Typography>
+                  <Typography>Drag & drop a .zip, .tar.gz or .tar.zst archive here, or click to select</Typography>
                 )}
               </div>
               {status === 'loading' && <Typography>Uploading...</Typography>}